@@ -0,0 +1,246 @@
+from data import *
+from loaders import *
+from visualizer import *
+from storage import *
+import argparse
+import csv
+import platform
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+BENCH_OUTPUT_FILE = "./bench_output.txt"
+BENCH_SCALES = {
+    'small': {'nb_games': 1000, 'nb_players': 50, 'nb_months': 12, 'plots': True},
+    'medium': {'nb_games': 10000, 'nb_players': 200, 'nb_months': 36, 'plots': False},
+    'large': {'nb_games': 100000, 'nb_players': 1000, 'nb_months': 120, 'plots': False},
+}
+BENCH_MAX_CSV_FILES = 200 # Nombre de parties exportees en csv pour les chargements
+BENCH_MAX_EXCEL_GAMES = 10000 # Nombre de parties du classeur excel genere
+BENCH_MAX_INCREMENTAL_GAMES = 1000 # Parties ajoutees une par une a la fin de l'historique
+BENCH_START_DATE = dt.datetime(2020, 1, 1)
+
+def generate_tournament(nb_games: int, nb_players: int, nb_months: int, seed: int = 0) -> tuple[list[Player], dict[str, str], list[Game]]:
+    """
+    Synthetic tournament : players with 0 to 2 extra aliases, games of 4 players
+    with 9 to 16 rounds whose end points sum to 0, spread over 'nb_months' months
+    return (players, aliases, games sorted by date)
+    """
+    rng = random.Random(seed)
+    players = []
+    aliases = {}
+    player_aliases = []
+    for i in range(nb_players):
+        name = f"Joueur {i:04d}"
+        players.append(Player(name, round(rng.gauss(1000, 80), 2)))
+        aliases[name] = name
+        player_aliases.append([name])
+        for j in range(rng.randint(0, 2)):
+            alias = f"{name} {j + 2}"
+            aliases[alias] = name
+            player_aliases[-1].append(alias)
+
+    # Heures de jeu de 10h a 22h, chaque partie a sa propre seconde
+    nb_days = (dt.datetime(BENCH_START_DATE.year + (nb_months // 12), 1 + nb_months % 12, 1) - BENCH_START_DATE).days
+    seconds = rng.sample(range(nb_days * 12 * 3600), nb_games)
+    seconds.sort()
+    games = []
+    for second in seconds:
+        date = BENCH_START_DATE + dt.timedelta(days=second // (12 * 3600), hours=10, seconds=second % (12 * 3600))
+        names = tuple(rng.choice(player_aliases[id]) for id in rng.sample(range(nb_players), 4))
+        rounds = []
+        for iround in range(rng.randint(9, 16)):
+            winner = rng.choice(names + (None,))
+            discarder = rng.choice([name for name in names if name != winner] + [None]) if winner is not None else None
+            penalties = tuple(rng.choice([0] * 20 + [-10]) for i in range(4))
+            rounds.append(Round._trusted(winner, discarder, rng.randint(8, 40), penalties))
+        end_points = [rng.randint(-150, 150) for i in range(3)]
+        end_points.append(-sum(end_points))
+        games.append(Game._trusted(names, tuple(end_points), date, rounds))
+    return (players, aliases, games)
+
+def write_game_csv(game: Game, file_path: str):
+    """ Writes the game in the layout of the csv exports read by 'parse_game_csv' """
+    header = ['Round', 'Winner', 'Discarder', 'Hand Points']
+    header += [f"Points {name}" for name in game.players]
+    header += [f"Penalty {name}" for name in game.players]
+    header += ['Game name', 'Game start date', 'Game end date']
+    date_text = game.date.strftime("%a %b %d %H:%M:%S GMT+00:00 %Y")
+    game_name = game.date.strftime("%d/%m/%Y %H:%M")
+
+    # Points des rounds tires au hasard, le dernier round ramene aux points de fin
+    rng = random.Random(game.date.toordinal())
+    total = [0, 0, 0, 0]
+    with open(file_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for iround, r in enumerate(game.rounds):
+            if iround == len(game.rounds) - 1:
+                points = [game.end_points[i] - total[i] for i in range(4)]
+            else:
+                points = [rng.randint(-40, 40) for i in range(3)]
+                points.append(-sum(points))
+            total = [total[i] + points[i] for i in range(4)]
+            writer.writerow(
+                [iround + 1, r.winner or "-", r.discarder or "-", r.hand_points] + points +
+                list(r.penalties) + [game_name, date_text, "null"]
+            )
+            writer.writerow(["-"] * 4 + total + ["-"] * 7)
+
+def write_games_excel(players: list[Player], games: list[Game], file_path: str) -> bool:
+    """
+    Writes the players and the games in the layout read by 'parse_games_excel'
+    return False if openpyxl is not installed
+    """
+    try:
+        import openpyxl # type: ignore
+    except ImportError:
+        return False
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Donnees")
+    for igame, game in enumerate(games):
+        sheet.append(['Vent', 'Est', 'Sud', 'Ouest', 'Nord', f"Partie {igame + 1}"])
+        sheet.append(['Nom joueur'] + list(game.players) + [game.date])
+        sheet.append(['Mini-points'] + list(game.end_points))
+        sheet.append(['Points de table'] + list(rank_points(game.end_points)))
+    sheet = workbook.create_sheet("EMA points")
+    sheet.append([None])
+    sheet.append(['Noms', 'Elo base'])
+    for p in players:
+        sheet.append([p.name, p.base_elo])
+    workbook.save(file_path)
+    return True
+
+def measure(func: Callable, repeat: int, setup: Callable|None = None) -> list[float]:
+    """ Durations in seconds of 'repeat' calls of func(setup()), setup is not timed """
+    times = []
+    for i in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(arg) if setup is not None else func()
+        times.append(time.perf_counter() - start)
+    return times
+
+def run_scale(scale_name: str, scale: dict, repeat: int, seed: int, with_plots: bool, work_dir: Path) -> list[dict]:
+    results = []
+    def record(name: str, times: list[float], **info):
+        result = {
+            'scale': scale_name,
+            'nb_games': scale['nb_games'],
+            'nb_players': scale['nb_players'],
+            'benchmark': name,
+            'repeat': len(times),
+            'min': min(times),
+            'median': statistics.median(times),
+            'max': max(times),
+            **info
+        }
+        results.append(result)
+        print(f"{scale_name:8} {name:36} {result['median']:10.4f} s")
+
+    start = time.perf_counter()
+    players, aliases, games = generate_tournament(scale['nb_games'], scale['nb_players'], scale['nb_months'], seed)
+    record('generate', [time.perf_counter() - start])
+    def new_data(games: list[Game] = []) -> Data:
+        return Data._trusted(list(games), list(players), dict(aliases))
+
+    # Calculs
+    record('add_games', measure(lambda d: d.add_games(games), repeat, new_data))
+    nb_incremental = min(BENCH_MAX_INCREMENTAL_GAMES, len(games) // 10)
+    def add_one_by_one(d: Data):
+        for game in games[len(games) - nb_incremental:]:
+            d.add_game(game)
+    record('add_game_incremental', measure(add_one_by_one, repeat, lambda: new_data(games[:len(games) - nb_incremental])), nb_added=nb_incremental)
+    data = new_data(games)
+    record('_update_elo', measure(lambda: data._update_elo(), repeat))
+    record('_update_ema', measure(lambda: data._update_ema(), repeat))
+
+    # Statistiques, sans puis avec le cache du Visualizer
+    for stat in ['calc_winning_wind_full_game', 'calc_nb_encounters', 'calc_nemesis']:
+        record(stat, measure(lambda v: getattr(v, stat)(), repeat, lambda: Visualizer(data)))
+        visualizer = Visualizer(data)
+        getattr(visualizer, stat)()
+        record(stat + '_cached', measure(lambda: getattr(visualizer, stat)(), repeat))
+    record('_get_readable_elo_dict', measure(lambda d: d._get_readable_elo_dict(), repeat, lambda: new_data(games)))
+
+    # Sauvegardes, le journal est detache pour que le fichier binaire soit reecrit a chaque fois
+    def detach_journal(d: Data = data) -> Data:
+        if d.journal is not None:
+            d.journal.close()
+            d.journal = None
+        return d
+    for extension in ['json', 'bin']:
+        file_path = str(work_dir / f"save.{extension}")
+        record(f"save_{extension}", measure(lambda d: save_data(d, file_path), repeat, detach_journal))
+        record(f"load_{extension}", measure(lambda: load_data(file_path, read_only=True), repeat))
+    detach_journal()
+
+    # Chargements des fichiers d'import
+    csv_dir = work_dir / "csv"
+    csv_dir.mkdir()
+    csv_games = games[-min(BENCH_MAX_CSV_FILES, len(games)):]
+    for igame, game in enumerate(csv_games):
+        write_game_csv(game, str(csv_dir / f"game_{igame:04d}.csv"))
+    csv_paths = [str(path) for path in sorted(csv_dir.iterdir())]
+    record('parse_game_csv', measure(lambda: [parse_game_csv(path) for path in csv_paths], repeat), nb_files=len(csv_paths))
+    ingest_data = lambda: DataLoader(new_data(games[:len(games) - len(csv_games)]))
+    record('load_folder_csv', measure(lambda loader: loader.load_folder(str(csv_dir)), repeat, ingest_data), nb_files=len(csv_paths))
+
+    excel_games = games[:BENCH_MAX_EXCEL_GAMES]
+    excel_path = str(work_dir / "games.xlsx")
+    if write_games_excel(players, excel_games, excel_path):
+        record('parse_games_excel', measure(lambda: parse_games_excel(excel_path), repeat), nb_excel_games=len(excel_games))
+        record('load_games_excel', measure(lambda loader: loader.load_games_excel(excel_path), repeat, lambda: DataLoader(new_data())), nb_excel_games=len(excel_games))
+
+    # Graphes, redessines puis repris du cache
+    if with_plots and scale['plots']:
+        visualizer = Visualizer(data)
+        plot_dir = work_dir / "plots"
+        def clean_plot_dir():
+            shutil.rmtree(plot_dir, ignore_errors=True)
+            return visualizer
+        record('plot_elos', measure(lambda v: v.plot_elos(4, str(plot_dir) + "/"), repeat, clean_plot_dir))
+        record('plot_elos_cached', measure(lambda: visualizer.plot_elos(4, str(plot_dir) + "/"), repeat))
+        record('plot_emas', measure(lambda v: v.plot_emas(str(plot_dir) + "/"), repeat, clean_plot_dir))
+        record('plot_emas_cached', measure(lambda: visualizer.plot_emas(str(plot_dir) + "/"), repeat))
+    return results
+
+def run_benchmarks(scale_names: list[str], repeat: int = 3, seed: int = 0, with_plots: bool = True, output_file: str = BENCH_OUTPUT_FILE) -> list[dict]:
+    """
+    Times the main paths on synthetic tournaments of each scale
+    The results are written to 'output_file' as json
+    """
+    results = []
+    for scale_name in scale_names:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results += run_scale(scale_name, BENCH_SCALES[scale_name], repeat, seed, with_plots, Path(work_dir))
+
+    report = {
+        'meta': {
+            'date': dt.datetime.now().isoformat(timespec="seconds"),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'nb_cpus': os.cpu_count(),
+            'seed': seed,
+            'repeat': repeat
+        },
+        'results': results
+    }
+    with open(output_file, "w") as f:
+        json.dump(report, f, indent=4)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks sur des tournois generes")
+    parser.add_argument("--scales", nargs="+", choices=list(BENCH_SCALES), default=['small', 'medium'])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-plots", action="store_true")
+    parser.add_argument("--output", default=BENCH_OUTPUT_FILE)
+    args = parser.parse_args()
+    run_benchmarks(args.scales, args.repeat, args.seed, not(args.no_plots), args.output)
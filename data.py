@@ -1,7 +1,15 @@
 from __future__ import annotations
 import datetime as dt
-import pandas as pd # type: ignore
+import json
+import numpy as np
+import struct
+import sys
+import zlib
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
 from copy import deepcopy
+from typing import Iterable, Iterator
+from profiling import profiled
 
 ELO_DIFF_SCALING = 400.0
 ELO_K = 20.0
@@ -10,44 +18,149 @@ ELO_K_NEWBIE_SCALE = 2.0
 EMA_MIN_GAIN = 50.0
 EMA_MAX_GAIN = 500.0
 EMA_MIN_GAMES_PER_MONTH = 4
+ELO_CHECKPOINT_INTERVAL = 64 # Une ligne complete de l'historique des elos toutes les N parties
+CHANGES_MAX_LENGTH = 10000 # Au dela, la moitie la plus ancienne de la liste des changements est oubliee
+EMA_DTYPE = np.dtype([('elo', np.float64), ('games', np.int64), ('gain', np.float64), ('total', np.float64), ('rank', np.int64)])
+EMA_FIELDS = ['elo', 'nb games', 'ema gain', 'total ema', 'rank'] # Noms exportes des champs de EMA_DTYPE
+BINARY_MAGIC = b"MJEL"
+BINARY_VERSION = 1
+BINARY_EPOCH = dt.datetime(1970, 1, 1)
+BINARY_ARRAY_HEADER = "<3sQ" # Type de chaque tableau, independant de la plateforme, puis sa longueur
+
+def rank_points(end_points: list[int]) -> list[float]:
+    """
+    Points of each seat from its place in the game : 0 for the last, 3 for the first
+    Tied seats share the average of their places, like pd.Series.rank()
+    """
+    points = []
+    for p1 in end_points:
+        nb_lower = 0
+        nb_equal = -1
+        for p2 in end_points:
+            if p2 < p1:
+                nb_lower += 1
+            elif p2 == p1:
+                nb_equal += 1
+        points.append(nb_lower + nb_equal / 2)
+    return points
+
+def expected_points(elos: list[float]) -> list[float]:
+    """ Points each seat is expected to score against the others, from the elo differences """
+    expected = []
+    for i in range(len(elos)):
+        e = 0.0
+        for j in range(len(elos)):
+            if i != j:
+                e += 1.0 / (1.0 + 10 ** ((elos[j] - elos[i]) / ELO_DIFF_SCALING))
+        expected.append(e)
+    return expected
+
+def elo_gains(elos: list[float], nb_games: list[int], end_points: list[int]) -> list[float]:
+    """ Elo gain of each seat, with the bigger K of the players with few games """
+    points = rank_points(end_points)
+    expected = expected_points(elos)
+    gains = []
+    for i in range(len(elos)):
+        coef = ELO_K + ELO_K_NEWBIE_ADD / (ELO_K_NEWBIE_SCALE + nb_games[i])
+        gains.append(coef * (points[i] - expected[i]))
+    return gains
+
+def _pack_arrays(arrays: list[np.ndarray]) -> bytes:
+    """
+    Concatenates the arrays in little endian, each one preceded by its dtype as a
+    3 chars code ('<i8', '<f8', '|u1') whose size is the same on every platform, and its length
+    """
+    chunks = []
+    for array in arrays:
+        array = array.astype(array.dtype.newbyteorder("<"))
+        chunks.append(struct.pack(BINARY_ARRAY_HEADER, array.dtype.str.encode(), len(array)))
+        chunks.append(array.tobytes())
+    return b"".join(chunks)
+
+def _unpack_arrays(payload: bytes) -> list[list]:
+    """ Inverse of '_pack_arrays', the arrays are returned as python lists """
+    arrays = []
+    offset = 0
+    while offset < len(payload):
+        code, length = struct.unpack_from(BINARY_ARRAY_HEADER, payload, offset)
+        offset += struct.calcsize(BINARY_ARRAY_HEADER)
+        dtype = np.dtype(code.decode())
+        arrays.append(np.frombuffer(payload, dtype, length, offset).tolist())
+        offset += length * dtype.itemsize
+    return arrays
+
+def _intern(name: str|None) -> str|None:
+    """ Names repeated in many rounds share a single string """
+    return None if name is None else sys.intern(name)
 
 class Round:
-    def __init__(self, winner: str|None, discarder: str|None, hand_points: int, penalties: dict[str, int]|None = None):
+    """
+    Penalties are stored in the seat order of the game : (East, South, West, North)
+    """
+    __slots__ = ('winner', 'discarder', 'hand_points', 'penalties')
+
+    def __init__(self, winner: str|None, discarder: str|None, hand_points: int|str, penalties: dict[str, int]|list[int]|None = None):
         self.winner = winner
         self.discarder = discarder
-        self.hand_points = hand_points
+        self.hand_points = int(hand_points)
         if penalties is None:
-            self.penalties = {}
-        self.penalties = deepcopy(penalties)
+            penalties = {}
+        if isinstance(penalties, dict): # Cles dans l'ordre des sieges
+            penalties = penalties.values()
+        self.penalties = tuple(int(p) for p in penalties)
+
+    @classmethod
+    def _trusted(cls, winner: str|None, discarder: str|None, hand_points: int, penalties: tuple[int, ...]) -> Round:
+        """ Builds the round from already normalized values, without any conversion """
+        r = cls.__new__(cls)
+        r.winner = winner
+        r.discarder = discarder
+        r.hand_points = hand_points
+        r.penalties = penalties
+        return r
     
-    def to_dict(self) -> dict:
+    def to_dict(self, players: list[str]) -> dict:
         return {
             "winner": self.winner,
             "discarder": self.discarder,
             "hand_points": self.hand_points,
-            "penalties": self.penalties
+            "penalties": dict(zip(players, self.penalties))
         }
 
     @classmethod
     def from_dict(cls, data: dict) -> Round:
-        return Round(
-            winner = data['winner'],
-            discarder = data['discarder'],
-            hand_points = data['hand_points'],
-            penalties = data['penalties']
+        return Round._trusted(
+            winner = _intern(data['winner']),
+            discarder = _intern(data['discarder']),
+            hand_points = int(data['hand_points']),
+            penalties = tuple(int(p) for p in data['penalties'].values())
         )
 
     def __str__(self):
         return f"winner={self.winner}, discarder={self.discarder}, points={self.hand_points}, penalties={self.penalties}"
 
 class Game:
+    __slots__ = ('players', 'end_points', 'date', 'rounds', 'player_ids')
+
     def __init__(self, players: list[str], end_points: list[int], date: dt.datetime, rounds: list[Round]|None = None):
-        self.players = deepcopy(players)
-        self.end_points = deepcopy(end_points)
+        self.players = tuple(players)
+        self.end_points = tuple(int(p) for p in end_points)
         self.date = date
         if rounds is None:
             rounds = []
         self.rounds = deepcopy(rounds)
+        self.player_ids = None # Resolus par Data a l'insertion
+
+    @classmethod
+    def _trusted(cls, players: tuple[str, ...], end_points: tuple[int, ...], date: dt.datetime, rounds: list[Round]) -> Game:
+        """ Builds the game from already normalized values, 'rounds' must not be modified afterwards """
+        game = cls.__new__(cls)
+        game.players = players
+        game.end_points = end_points
+        game.date = date
+        game.rounds = rounds
+        game.player_ids = None
+        return game
 
     def update_rounds(self, rounds: list[Round]) -> tuple[int, str]:
         """
@@ -77,17 +190,17 @@ class Game:
     
     def to_dict(self) -> dict:
         return {
-            "players": self.players,
-            "end_points": self.end_points,
+            "players": list(self.players),
+            "end_points": list(self.end_points),
             "date": self.date.isoformat(),
-            "rounds": [r.to_dict() for r in self.rounds]
+            "rounds": [r.to_dict(self.players) for r in self.rounds]
         }
     
     @classmethod
     def from_dict(cls, data: dict) -> Game:
-        return Game(
-            players = data['players'],
-            end_points = data['end_points'],
+        return Game._trusted(
+            players = tuple(_intern(name) for name in data['players']),
+            end_points = tuple(int(p) for p in data['end_points']),
             date = dt.datetime.fromisoformat(data['date']),
             rounds = [Round.from_dict(r) for r in data['rounds']]
         )
@@ -130,28 +243,229 @@ class Player:
             base_elo = data['base_elo']
         )
 
+class PlayerHistory:
+    """
+    Table tab[num game][player name] of the values after each game
+    Each game only stores the new values of its 4 players, a full row is kept every
+    ELO_CHECKPOINT_INTERVAL games and at the end of each month ('checkpoint_last') :
+    a row is rebuilt from the nearest checkpoint before it with a short replay
+    'names' are given by player id, 'columns' {name: id} iterates them by name
+    """
+    def __init__(self, names: list[str], dtype: type, initial: list):
+        self.columns = dict(sorted(zip(names, range(len(names)))))
+        self.initial = np.array(initial, dtype=dtype).reshape(len(names))
+        self.ids = np.zeros((16, 4), dtype=np.int64)
+        self.values = np.zeros((16, 4), dtype=dtype)
+        self.checkpoint_games = [] # Parties suivies d'une ligne complete, croissantes
+        self.checkpoint_rows = []
+        self.last = self.initial.copy()
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, igame: int) -> dict:
+        values = self.row(igame).tolist()
+        return {name: values[col] for name, col in self.columns.items()}
+
+    def row(self, igame: int) -> np.ndarray:
+        if igame < 0:
+            igame += self.size
+        if not(0 <= igame < self.size):
+            raise IndexError("num game hors limites")
+        if igame == self.size - 1:
+            return self.last.copy()
+        return self._rebuild(igame)
+
+    def rows(self, first_game: int = 0) -> Iterator[np.ndarray]:
+        """ Rows from 'first_game' to the last one, replayed one game after the other """
+        row = self._rebuild(first_game - 1)
+        for igame in range(first_game, self.size):
+            row[self.ids[igame]] = self.values[igame]
+            yield row.copy()
+
+    def value(self, igame: int, name: str):
+        """ Value of one column after the game 'igame' (-1 for the initial value) """
+        col = self.columns[name]
+        icheckpoint = bisect_right(self.checkpoint_games, igame) - 1
+        first_game = self.checkpoint_games[icheckpoint] + 1 if icheckpoint >= 0 else 0
+        games, seats = np.nonzero(self.ids[first_game:igame+1] == col)
+        if len(games) > 0:
+            return self.values[first_game + games[-1], seats[-1]].item()
+        if icheckpoint >= 0:
+            return self.checkpoint_rows[icheckpoint][col].item()
+        return self.initial[col].item()
+
+    def column(self, name: str) -> np.ndarray:
+        """ Values of one column after each game, forward filled from the games of the player """
+        col = self.columns[name]
+        games, seats = np.nonzero(self.ids[:self.size] == col)
+        last_change = np.full(self.size, -1)
+        last_change[games] = np.arange(len(games))
+        last_change = np.maximum.accumulate(last_change)
+        values = np.append(self.values[games, seats], self.initial[col])
+        return values[last_change] # L'indice -1 donne la valeur initiale
+
+    def append(self, ids: tuple[int, ...], values: list):
+        if self.size == len(self.ids): # Capacite doublee
+            self.ids = np.concatenate([self.ids, np.zeros_like(self.ids)])
+            self.values = np.concatenate([self.values, np.zeros_like(self.values)])
+        self.ids[self.size] = ids
+        self.values[self.size] = values
+        self.last[list(ids)] = values
+        self.size += 1
+        if self.size % ELO_CHECKPOINT_INTERVAL == 0:
+            self.checkpoint_last()
+
+    def checkpoint_last(self):
+        """ Keeps a full copy of the last row """
+        if self.size > 0 and (len(self.checkpoint_games) == 0 or self.checkpoint_games[-1] != self.size - 1):
+            self.checkpoint_games.append(self.size - 1)
+            self.checkpoint_rows.append(self.last.copy())
+
+    def truncate(self, size: int):
+        if size >= self.size:
+            return
+        nb_kept = bisect_left(self.checkpoint_games, size)
+        del self.checkpoint_games[nb_kept:]
+        del self.checkpoint_rows[nb_kept:]
+        self.last = self._rebuild(size - 1)
+        self.size = size
+
+    def add_column(self, name: str, value):
+        """ New last column, with the same value after every game """
+        self.columns[name] = len(self.initial)
+        self.columns = dict(sorted(self.columns.items()))
+        self.initial = np.append(self.initial, value).astype(self.initial.dtype)
+        self.last = np.append(self.last, value).astype(self.last.dtype)
+        self.checkpoint_rows = [np.append(row, value).astype(row.dtype) for row in self.checkpoint_rows]
+
+    def remove_column(self, name: str):
+        """ The games where this column changed must be truncated afterwards """
+        col = self.columns.pop(name)
+        self.initial = np.delete(self.initial, col)
+        self.last = np.delete(self.last, col)
+        self.checkpoint_rows = [np.delete(row, col) for row in self.checkpoint_rows]
+        self.ids[self.ids > col] -= 1
+        self.columns = {n: i - (i > col) for n, i in self.columns.items()}
+
+    def _rebuild(self, igame: int) -> np.ndarray:
+        """ Row after the game 'igame' (-1 for the initial row) from the nearest checkpoint """
+        icheckpoint = bisect_right(self.checkpoint_games, igame) - 1
+        if icheckpoint >= 0:
+            first_game = self.checkpoint_games[icheckpoint] + 1
+            row = self.checkpoint_rows[icheckpoint].copy()
+        else:
+            first_game = 0
+            row = self.initial.copy()
+        for jgame in range(first_game, igame + 1):
+            row[self.ids[jgame]] = self.values[jgame]
+        return row
+
+class EmaHistory:
+    """
+    Table tab[month](num_month, {player name: stats_ema}) stored as a
+    (months x players) numpy array of EMA_DTYPE, with the num and the last game of each month
+    'names' are given by player id, 'columns' {name: id} iterates them by name
+    """
+    def __init__(self, names: list[str]):
+        self.columns = dict(sorted(zip(names, range(len(names)))))
+        self.values = np.zeros((4, len(names)), dtype=EMA_DTYPE)
+        self.months = np.zeros(4, dtype=np.int64)
+        self.last_game = np.zeros(4, dtype=np.int64)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, imonth: int) -> tuple[int, dict]:
+        values = self.row(imonth).tolist()
+        if imonth < 0:
+            imonth += self.size
+        return (int(self.months[imonth]), {
+            name: dict(zip(EMA_FIELDS, values[col])) for name, col in self.columns.items()
+        })
+
+    def __iter__(self) -> Iterator[tuple[int, dict]]:
+        for imonth in range(self.size):
+            yield self[imonth]
+
+    def row(self, imonth: int) -> np.ndarray:
+        if imonth < 0:
+            imonth += self.size
+        if not(0 <= imonth < self.size):
+            raise IndexError("num mois hors limites")
+        return self.values[imonth]
+
+    def append(self, num_month: int, last_game: int, row: np.ndarray):
+        if self.size == len(self.values): # Capacite doublee
+            self.values = np.concatenate([self.values, np.zeros_like(self.values)])
+            self.months = np.concatenate([self.months, np.zeros_like(self.months)])
+            self.last_game = np.concatenate([self.last_game, np.zeros_like(self.last_game)])
+        self.values[self.size] = row
+        self.months[self.size] = num_month
+        self.last_game[self.size] = last_game
+        self.size += 1
+
+    def truncate(self, size: int):
+        self.size = min(self.size, size)
+
+    def add_column(self, name: str, stats: tuple):
+        """ New last column, with the same stats every month """
+        self.columns[name] = self.values.shape[1]
+        self.columns = dict(sorted(self.columns.items()))
+        self.values = np.concatenate([self.values, np.zeros((len(self.values), 1), dtype=EMA_DTYPE)], axis=1)
+        self.values[:, -1] = stats
+
+    def remove_column(self, name: str):
+        col = self.columns.pop(name)
+        self.values = np.delete(self.values, col, axis=1)
+        self.columns = {n: i - (i > col) for n, i in self.columns.items()}
+
 class Data:
     def __init__(self, games: list[Game] = [], players: list[Player] = [], aliases: dict[str, str] = {}):
-        self.games = deepcopy(games)
-        self.players = deepcopy(players)
-        self.aliases = deepcopy(aliases)
-        self.name_to_player_id = {}
-        for i in range(len(players)):
-            self.name_to_player_id[players[i].name] = i
+        self._setup(deepcopy(games), deepcopy(players), deepcopy(aliases))
+
+    @classmethod
+    def _trusted(cls, games: list[Game], players: list[Player], aliases: dict[str, str]) -> Data:
+        """ Builds the data without copying the arguments, which must not be used afterwards """
+        data = cls.__new__(cls)
+        data._setup(games, players, aliases)
+        return data
+
+    def _setup(self, games: list[Game], players: list[Player], aliases: dict[str, str]):
+        self.games = games
+        self.players = sorted(players)
+        self.player_by_id = list(self.players) # Ordre d'ajout : l'id d'un joueur ne change qu'a la suppression d'un autre
+        self.aliases = aliases
+        self._update_player_index()
+        self.elo = PlayerHistory([], float, [])
+        self.nb_games = PlayerHistory([], int, [])
+        self.ema = EmaHistory([])
+        self.ingest_from_game = None
+        self.journal = None
+        self.version = 0
+        self.changes = []
+        self.changes_start = 0
+        self.games_by_key = {}
+        for game in self.games:
+            self.games_by_key.setdefault(self._game_key(game), game)
         self._update_ema()
     
+    @profiled
     def add_game(self, game: Game) -> tuple[int, str]:
-        for igame in range(len(self.games)):
-            g = self.games[igame]
-            if (self._calc_aliases(g.players), g.end_points, g.date) == (self._calc_aliases(game.players), game.end_points, game.date): # Parties egales aux alias pres
-                err_code, err_mess = self.games[igame].update_rounds(game.rounds)
-                if err_code == 0:
-                    return (1, "Partie en double (Rounds ajoutes)")
-                else:
-                    return (1, "Partie en double")
+        key = self._game_key(game)
+        if key in self.games_by_key: # Parties egales aux alias pres
+            err_code, err_mess = self.games_by_key[key].update_rounds(game.rounds)
+            if err_code == 0:
+                self._log('add_rounds', game=game)
+                self._record('add_rounds', self.games_by_key[key])
+                return (1, "Partie en double (Rounds ajoutes)")
+            else:
+                return (1, "Partie en double")
 
         for i in range(len(game.players)):
-            if not(game.players[i] in self.aliases):
+            if not(game.players[i] in self.alias_to_player_id):
                 return (2, "Joueur inconnu")
 
         if sum(game.end_points) != 0:
@@ -160,20 +474,63 @@ class Data:
         if len(game.rounds) != 0 and len(game.rounds) < 9:
             return (4, "Ouest non atteint")
         
-        self.games.append(game)
-        self._update_ema()
+        # Insertion a sa place chronologique, seules les parties suivantes sont recalculees
+        game.player_ids = tuple(self.alias_to_player_id[alias] for alias in game.players)
+        pos = bisect_right(self.games, game)
+        self.games.insert(pos, game)
+        self.games_by_key[key] = game
+        for id in set(game.player_ids):
+            self.games_by_player[id].append(game)
+        self._request_update(pos)
+        self._log('add_game', game=game)
+        self._record('add_game', game)
         return (0, "")
 
+    @profiled
+    def add_games(self, games: Iterable[Game]) -> list[tuple[int, str]]:
+        """
+        Adds several games with a single Elo/EMA recomputation at the end
+        return the (err_code, err_mess) of each game
+        """
+        with self.ingest():
+            return [self.add_game(game) for game in games]
+
+    @contextmanager
+    def ingest(self) -> Iterator[Data]:
+        """
+        Defers the Elo/EMA recomputation until the end of the block
+        """
+        if self.ingest_from_game is not None: # Deja en mode differe
+            yield self
+            return
+        self.ingest_from_game = len(self.games)
+        try:
+            yield self
+        finally:
+            from_game = self.ingest_from_game
+            self.ingest_from_game = None
+            self._update_ema(from_game)
+
     def add_player(self, player: Player) -> tuple[int, str]:
         if player in self.players:
             return (1, "Joueur deja present")
         if player in self.aliases:
             return (2, "Alias deja present")
 
-        self.players.append(player)
+        # Sans partie, le nouveau joueur ne change aucun elo : une colonne de plus suffit
+        id = len(self.player_by_id)
+        self.player_by_id.append(player)
+        insort(self.players, player)
         self.aliases[player.name] = player.name
-        self.name_to_player_id[player.name] = len(self.players) - 1
-        self._update_ema()
+        self.name_to_player_id[player.name] = id
+        self.alias_to_player_id[player.name] = id
+        self.aliases_by_player[player.name] = [player.name]
+        self.games_by_player.append([])
+        self.elo.add_column(player.name, player.base_elo)
+        self.nb_games.add_column(player.name, 0)
+        self.ema.add_column(player.name, (player.base_elo, 0, 0.0, 0.0, -1))
+        self._log('add_player', player=player)
+        self._record('add_player', player)
         return (0, "")
 
     def add_alias(self, alias: str, player_name: str) -> tuple[int, str]:
@@ -182,170 +539,343 @@ class Data:
         if not(player_name in self.players):
             return (2, "Joueur non present")
 
+        # Un nouvel alias n'apparait dans aucune partie, l'index des parties reste valide
         self.aliases[alias] = player_name
+        self.alias_to_player_id[alias] = self.name_to_player_id[player_name]
+        self.aliases_by_player[player_name].append(alias)
+        self._log('add_alias', alias=alias, name=player_name)
+        self._record('add_alias', alias)
         return (0, "")
     
     def remove_player(self, player_name: str) -> tuple[int, str]:
-        if not(player_name) in self.players:
+        if not(player_name in self.players):
             return (1, "Joueur inexistant")
         
-        games_to_remove = []
-        for igame in range(len(self.games)):
-            if player_name in self.games[igame].players:
-                games_to_remove.append(igame)
-        aliases_to_remove = []
-        for alias in self.aliases.keys():
-            if self.aliases[alias] == player_name:
-                aliases_to_remove.append(alias)
-        self.remove_games(games_to_remove)
-        self.remove_aliases(aliases_to_remove)
-        player_id = 0
-        while self.players[player_id].name != player_name:
-            player_id += 1
-        self.players.pop(player_id)
+        # Les parties precedant sa premiere partie ne sont pas recalculees
+        player_id = self.name_to_player_id[player_name]
+        with self.ingest():
+            self._remove_games(self.games_of_player(player_name))
+            self._remove_aliases(list(self.aliases_by_player[player_name]))
+            self.players.remove(player_name)
+            self.player_by_id.pop(player_id)
+            if self.ingest_from_game == 0: # Tout sera recalcule, sans chirurgie des colonnes
+                self._clear_histories()
+            else:
+                for history in [self.elo, self.nb_games, self.ema]:
+                    if player_name in history.columns:
+                        history.remove_column(player_name)
+            self._update_player_index()
+        self._log('remove_player', name=player_name)
+        self._record('remove_player', player_name)
         return (0, "")
 
     def remove_games(self, game_ids: list[int]):
-        game_ids.append(len(self.games) + 10)
-        new_games = []
-        remove_id = 0
-        for id in range(len(self.games)):
-            if id == game_ids[remove_id]:
-                remove_id += 1
-            else:
-                new_games.append(self.games[id])
-        game_ids.pop()
-        self.games = new_games
+        """ Removes the games at these positions of self.games """
+        self._remove_games(game_ids)
+        self._log('remove_games', game_ids=sorted(set(game_ids)))
 
     def remove_aliases(self, aliases: list[str]):
+        self._remove_aliases(aliases)
+        self._log('remove_aliases', aliases=list(aliases))
+
+    def _remove_games(self, game_ids: list[int]):
+        if len(game_ids) == 0:
+            return
+        removed = set(game_ids)
+        for id in removed:
+            game = self.games[id]
+            key = self._game_key(game)
+            if self.games_by_key.get(key) is game:
+                del self.games_by_key[key]
+            for player_id in set(game.player_ids):
+                player_games = self.games_by_player[player_id]
+                player_games[:] = [g for g in player_games if g is not game]
+        self.games = [game for id, game in enumerate(self.games) if not(id in removed)]
+        self._record('remove_games')
+        self._request_update(min(removed))
+
+    def _remove_aliases(self, aliases: list[str]):
         for alias in aliases:
-            self.aliases.pop(alias, None)
+            name = self.aliases.pop(alias, None)
+            self.alias_to_player_id.pop(alias, None)
+            if name in self.aliases_by_player:
+                self.aliases_by_player[name].remove(alias)
+        self._record('remove_aliases')
+
+    def games_of_player(self, player_name: str) -> list[int]:
+        """ Sorted positions of the games of a player, under all its aliases """
+        ids = []
+        for game in self.games_by_player[self.name_to_player_id[player_name]]:
+            id = bisect_left(self.games, game)
+            while self.games[id] is not game: # Parties egales a l'ordre pres
+                id += 1
+            ids.append(id)
+        return sorted(ids)
 
-    def _update_elo(self):
+    def aliases_of_player(self, player_name: str) -> list[str]:
+        return list(self.aliases_by_player[player_name])
+
+    def elo_at(self, player_name: str, date: dt.datetime) -> float|None:
         """
-        Format de 'elo' et 'nb_games' : tab[num game][player name]
+        Elo of a player (or one of its aliases) after the games played up to 'date' included
+        None if the player is unknown
         """
-        self.games = sorted(self.games)
-        self.players = sorted(self.players)
-        current_elo = {}
-        current_nb_games = {}
-        for p in self.players:
-            current_elo[p.name] = p.base_elo
-            current_nb_games[p.name] = 0
-        self.elo = []
-        self.nb_games = []
+        name = self.aliases.get(player_name, player_name)
+        if not(name in self.elo.columns):
+            return None
+        igame = bisect_right(self.games, date, key=lambda game: game.date) - 1
+        return self.elo.value(igame, name)
+
+    def leaderboard_at(self, date: dt.datetime) -> list[tuple[str, float, int]]:
+        """ (name, elo, nb games) of the players with games up to 'date' included, best elo first """
+        igame = bisect_right(self.games, date, key=lambda game: game.date) - 1
+        if igame < 0:
+            return []
+        elos = self.elo[igame]
+        nb_games = self.nb_games[igame]
+        board = [(name, elos[name], nb_games[name]) for name in self.elo.columns if nb_games[name] > 0]
+        board.sort(key=lambda x: x[1], reverse=True)
+        return board
+
+    def apply_journal_entry(self, entry: dict) -> tuple[int, str]:
+        """ Replays a mutation recorded by '_log' """
+        op = entry['op']
+        if op == 'add_game' or op == 'add_rounds': # Une partie en double fusionne ses rounds
+            return self.add_game(Game.from_dict(entry['game']))
+        elif op == 'add_player':
+            return self.add_player(Player.from_dict(entry['player']))
+        elif op == 'add_alias':
+            return self.add_alias(entry['alias'], entry['name'])
+        elif op == 'remove_player':
+            return self.remove_player(entry['name'])
+        elif op == 'remove_games': # Positions valides sur les donnees rejouees jusque la
+            self.remove_games(entry['game_ids'])
+            return (0, "")
+        elif op == 'remove_aliases':
+            self.remove_aliases(entry['aliases'])
+            return (0, "")
+        return (-1, f"Operation inconnue : {op}")
+
+    def changes_since(self, version: int|None) -> list[tuple[str, object]]|None:
+        """
+        Changes (kind, object) made after 'version', oldest first
+        None if they are not all known anymore : the caller must start from scratch
+        """
+        if version is None or version < self.changes_start:
+            return None
+        return self.changes[version - self.changes_start:]
+
+    def _record(self, kind: str, obj: object = None):
+        """ Increments the version of the data and remembers what changed """
+        self.changes.append((kind, obj))
+        self.version += 1
+        if len(self.changes) > CHANGES_MAX_LENGTH:
+            nb_forgotten = len(self.changes) // 2
+            self.changes = self.changes[nb_forgotten:]
+            self.changes_start += nb_forgotten
+
+    def _log(self, op: str, **payload):
+        """
+        Records a mutation in the journal, if one is attached
+        Games and players are only converted to dicts then
+        """
+        if self.journal is not None:
+            entry = {'op': op}
+            for key, value in payload.items():
+                entry[key] = value.to_dict() if isinstance(value, (Game, Player)) else value
+            self.journal.append(entry)
 
+    def _update_player_index(self):
+        """
+        The id of a player is its place in self.player_by_id, in the order the players were added
+        Ids only change when a player is removed, the games are resolved again then
+        Also indexes the games and the aliases of each player
+        """
+        self.name_to_player_id = {}
+        self.aliases_by_player = {}
+        for i in range(len(self.player_by_id)):
+            self.name_to_player_id[self.player_by_id[i].name] = i
+            self.aliases_by_player[self.player_by_id[i].name] = []
+        self.alias_to_player_id = {}
+        for alias, name in self.aliases.items():
+            if name in self.name_to_player_id:
+                self.alias_to_player_id[alias] = self.name_to_player_id[name]
+                self.aliases_by_player[name].append(alias)
+        self.games_by_player = [[] for p in self.player_by_id]
         for game in self.games:
-            rank_points = pd.Series(game.end_points).rank()
-            game_points = {}
-            for i in range(len(game.players)):
-                game_points[game.players[i]] = float(rank_points[i]) - 1
-            
-            expected_points = {}
-            for alias1 in game.players:
-                expected_points[alias1] = 0.0
-                for alias2 in game.players:
-                    if alias1 != alias2:
-                        name1 = self.aliases[alias1]
-                        name2 = self.aliases[alias2]
-                        expected_points[alias1] += 1.0 / (1.0 + 10 ** ((current_elo[name2] - current_elo[name1]) / ELO_DIFF_SCALING))
-            
-            elo_gain = {}
-            for alias in game.players:
-                name = self.aliases[alias]
-                coef = ELO_K + ELO_K_NEWBIE_ADD / (ELO_K_NEWBIE_SCALE + current_nb_games[name])
-                elo_gain[alias] = coef * (game_points[alias] - expected_points[alias])
-            
-            for alias in game.players:
-                name = self.aliases[alias]
-                current_elo[name] += elo_gain[alias]
-                current_nb_games[name] += 1
-            self.elo.append(deepcopy(current_elo))
-            self.nb_games.append(deepcopy(current_nb_games))
-
-    def _update_ema(self):
+            game.player_ids = tuple(self.alias_to_player_id[alias] for alias in game.players)
+            for id in set(game.player_ids):
+                self.games_by_player[id].append(game)
+
+    def _clear_histories(self):
+        """ Empty histories with one column per player id, until the recompute from game 0 fills them """
+        names = [p.name for p in self.player_by_id]
+        self.elo = PlayerHistory(names, float, [p.base_elo for p in self.player_by_id])
+        self.nb_games = PlayerHistory(names, int, [0 for p in self.player_by_id])
+        self.ema = EmaHistory(names)
+
+    def _request_update(self, from_game: int):
+        """ Recomputes from 'from_game', or only records it while ingesting """
+        if self.ingest_from_game is None:
+            self._update_ema(from_game)
+        else:
+            self.ingest_from_game = min(self.ingest_from_game, from_game)
+
+    @profiled
+    def _update_elo(self, from_game: int = 0):
+        """
+        Format de 'elo' et 'nb_games' : tab[num game][player name]
+        Only the games from 'from_game' onward are replayed, the previous
+        snapshots are kept (self.games must already be sorted in that case)
+        """
+        if from_game == 0:
+            self.games = sorted(self.games)
+            names = [p.name for p in self.player_by_id]
+            self.elo = PlayerHistory(names, float, [p.base_elo for p in self.player_by_id])
+            self.nb_games = PlayerHistory(names, int, [0 for p in self.player_by_id])
+            current_elo = [p.base_elo for p in self.player_by_id]
+            current_nb_games = [0 for p in self.player_by_id]
+        else:
+            current_elo = self.elo.row(from_game-1).tolist()
+            current_nb_games = self.nb_games.row(from_game-1).tolist()
+        self.elo.truncate(from_game)
+        self.nb_games.truncate(from_game)
+
+        for igame in range(from_game, len(self.games)):
+            game = self.games[igame]
+            if igame > 0 and self._get_num_month(igame-1) != self._get_num_month(igame): # Fin du mois precedent
+                self.elo.checkpoint_last()
+                self.nb_games.checkpoint_last()
+            ids = game.player_ids
+            elo_gain = elo_gains(
+                [current_elo[id] for id in ids],
+                [current_nb_games[id] for id in ids],
+                game.end_points
+            )
+            for i in range(len(ids)):
+                current_elo[ids[i]] += elo_gain[i]
+                current_nb_games[ids[i]] += 1
+            self.elo.append(ids, [current_elo[id] for id in ids])
+            self.nb_games.append(ids, [current_nb_games[id] for id in ids])
+
+    @profiled
+    def _update_ema(self, from_game: int = 0):
         """
         Format de 'ema' : tab[month](num_month, {joueur: stats_ema})
         Stats for EMA : elo, nb games, ema gain, total ema, rank
+        Only the months from the one containing 'from_game' are recomputed
         """
-        self._update_elo()
-        last_nb_games = {}
-        current_ema_stats = {}
-        for p in self.players:
-            last_nb_games[p.name] = 0
-            current_ema_stats[p.name] = {
-                'elo': p.base_elo,
-                'nb games': 0,
-                'ema gain': 0,
-                'total ema': 0,
-                'rank': -1
-            }
-        self.ema = []
-
-        for igame in range(len(self.games)):
-            if igame == len(self.games)-1 or self._get_num_month(igame) != self._get_num_month(igame+1):
-                num_month = self._get_num_month(igame)
-                for p in self.players:
-                    current_ema_stats[p.name]['elo'] = self.elo[igame][p.name]
-                    current_ema_stats[p.name]['nb games'] = self.nb_games[igame][p.name] - last_nb_games[p.name]
-                    last_nb_games[p.name] = self.nb_games[igame][p.name]
-
-                list_elos = []
-                for p in self.players:
-                    if current_ema_stats[p.name]['nb games'] > 0:
-                        list_elos.append((current_ema_stats[p.name]['elo'], p.name))
-                    else:
-                        current_ema_stats[p.name]['rank'] = -1
-                list_elos.sort()
-                for pos in range(len(list_elos)):
-                    name = list_elos[pos][1]
-                    current_ema_stats[name]['rank'] = len(list_elos) - pos
-                
-                for p in self.players:
-                    rank = current_ema_stats[p.name]['rank']
-                    pos = len(list_elos) - rank
-                    nb_games = current_ema_stats[p.name]['nb games']
-                    current_ema_stats[p.name]['ema gain'] = (min(nb_games, EMA_MIN_GAMES_PER_MONTH) / EMA_MIN_GAMES_PER_MONTH) * (EMA_MIN_GAIN + (EMA_MAX_GAIN - EMA_MIN_GAIN) * (pos / (len(list_elos) - 1)))
-                    current_ema_stats[p.name]['total ema'] = current_ema_stats[p.name]['total ema'] + current_ema_stats[p.name]['ema gain']
-                
-                self.ema.append((num_month, deepcopy(current_ema_stats)))
+        self._update_elo(from_game)
+        self._record('recompute', from_game)
+
+        # Mois conserves : termines avant from_game et anterieurs a son mois
+        nb_kept_months = 0
+        if from_game == 0:
+            self.ema = EmaHistory([p.name for p in self.player_by_id])
+        else:
+            last_month = self._get_num_month(from_game) if from_game < len(self.games) else None
+            while (nb_kept_months < len(self.ema) and
+                   self.ema.last_game[nb_kept_months] < from_game and
+                   self.ema.months[nb_kept_months] != last_month):
+                nb_kept_months += 1
+        self.ema.truncate(nb_kept_months)
+
+        if nb_kept_months > 0:
+            first_game = int(self.ema.last_game[nb_kept_months-1]) + 1
+            last_nb_games = self.nb_games.row(first_game-1)
+            current_ema_stats = self.ema.row(-1).copy()
+        else:
+            first_game = 0
+            last_nb_games = np.zeros(len(self.player_by_id), dtype=np.int64)
+            current_ema_stats = np.zeros(len(self.player_by_id), dtype=EMA_DTYPE)
+            current_ema_stats['elo'] = [p.base_elo for p in self.player_by_id]
+            current_ema_stats['rank'] = -1
+        if first_game == len(self.games):
+            return
+
+        # Numeros des mois en une passe sur les dates, puis derniere partie de chaque mois
+        months = np.array([game.date for game in self.games[first_game:]], dtype='datetime64[M]').astype(np.int64) + 1970 * 12 + 1
+        last_games = np.flatnonzero(np.append(months[1:] != months[:-1], True))
+        name_ranks = np.empty(len(self.ema.columns), dtype=np.int64)
+        name_ranks[list(self.ema.columns.values())] = np.arange(len(self.ema.columns))
+
+        for igame in last_games:
+            nb_games_row = self.nb_games.row(first_game + igame)
+            current_ema_stats['elo'] = self.elo.row(first_game + igame)
+            current_ema_stats['games'] = nb_games_row - last_nb_games
+            last_nb_games = nb_games_row
+
+            # Seuls les joueurs ayant joue dans le mois sont classes, a elo egal par nom
+            active = np.flatnonzero(current_ema_stats['games'] > 0)
+            order = active[np.lexsort((name_ranks[active], current_ema_stats['elo'][active]))]
+            current_ema_stats['rank'] = -1
+            current_ema_stats['rank'][order] = len(active) - np.arange(len(active))
+
+            pos = len(active) - current_ema_stats['rank']
+            nb_games = current_ema_stats['games']
+            current_ema_stats['gain'] = (np.minimum(nb_games, EMA_MIN_GAMES_PER_MONTH) / EMA_MIN_GAMES_PER_MONTH) * (EMA_MIN_GAIN + (EMA_MAX_GAIN - EMA_MIN_GAIN) * (pos / (len(active) - 1)))
+            current_ema_stats['total'] += current_ema_stats['gain']
+
+            self.ema.append(months[igame], first_game + igame, current_ema_stats)
 
     def _get_readable_elo_dict(self) -> dict:
-        current_elo = {}
-        for p in self.players:
-            current_elo[p.name] = p.base_elo
+        """ Entry of each game by date, replayed from the first game at each call """
         elo_dict = {}
-        for igame in range(len(self.games)):
-            game = self.games[igame]
-            datestr = game.date.isoformat()
-            elo_dict[datestr] = {"elo": self.elo[igame]}
-            elo_dict[datestr]['elo_before'] = {}
-            elo_dict[datestr]['elo_diff'] = {}
-            elo_dict[datestr]['points'] = {}
-            elo_dict[datestr]['awaited_perf'] = {}
-            elo_dict[datestr]['elo_gain'] = {}
-            for iplayer in range(len(game.players)):
-                name = self.aliases[game.players[iplayer]]
-                elo_dict[datestr]['elo_gain'][name] = self.elo[igame][name] - current_elo[name]
-                elo_dict[datestr]['points'][name] = sorted(game.end_points).index(game.end_points[iplayer])
-                elo_dict[datestr]['elo_before'][name] = current_elo[name]
-                elo_dict[datestr]['awaited_perf'][name] = 0.0
-                mean_elo = 0
-                for alias2 in game.players:
-                    name2 = self.aliases[alias2]
-                    if name != name2:
-                        elo_dict[datestr]['awaited_perf'][name] += 1.0 / (1.0 + 10 ** ((current_elo[name2] - current_elo[name]) / ELO_DIFF_SCALING))
-                        mean_elo += current_elo[name2]
-                mean_elo /= len(game.players) - 1
-                elo_dict[datestr]['elo_diff'][name] = current_elo[name] - mean_elo
-            current_elo = self.elo[igame]
+        for game, entry in zip(self.games, self._iter_readable_elo_entries(0, len(self.games))):
+            elo_dict[game.date.isoformat()] = entry
         return elo_dict
 
+    def _iter_readable_elo_entries(self, first_game: int, last_game: int) -> Iterator[dict]:
+        """ Entries of the games from first_game to last_game excluded, the elos are replayed game after game """
+        if first_game == 0:
+            current_elo = {}
+            for p in self.players:
+                current_elo[p.name] = p.base_elo
+        else:
+            current_elo = self.elo[first_game-1]
+        rows = self.elo.rows(first_game)
+        for igame in range(first_game, last_game):
+            values = next(rows).tolist()
+            elo = {name: values[col] for name, col in self.elo.columns.items()}
+            yield self._get_readable_elo_entry(igame, current_elo, elo)
+            current_elo = elo
+
+    def _get_readable_elo_entry(self, igame: int, current_elo: dict, elo: dict) -> dict:
+        game = self.games[igame]
+        entry = {"elo": elo}
+        entry['elo_before'] = {}
+        entry['elo_diff'] = {}
+        entry['points'] = {}
+        entry['awaited_perf'] = {}
+        entry['elo_gain'] = {}
+        names = self._calc_aliases(game.players)
+        awaited_perf = expected_points([current_elo[name] for name in names])
+        for iplayer in range(len(game.players)):
+            name = names[iplayer]
+            entry['elo_gain'][name] = entry['elo'][name] - current_elo[name]
+            entry['points'][name] = sorted(game.end_points).index(game.end_points[iplayer])
+            entry['elo_before'][name] = current_elo[name]
+            entry['awaited_perf'][name] = awaited_perf[iplayer]
+            mean_elo = 0
+            for name2 in names:
+                if name != name2:
+                    mean_elo += current_elo[name2]
+            mean_elo /= len(game.players) - 1
+            entry['elo_diff'][name] = current_elo[name] - mean_elo
+        return entry
+
     def _get_num_month(self, igame: int) -> int:
         """ Returns the number of the month with year included """
         game = self.games[igame]
         return game.date.year * 12 + game.date.month
     
+    def _game_key(self, game: Game) -> tuple:
+        """
+        Key of the duplicate index : (official names, end points, date)
+        Unknown aliases are kept as None, such a game cannot be a duplicate
+        """
+        return (tuple(self.aliases.get(name) for name in game.players), tuple(game.end_points), game.date)
+
     def _calc_aliases(self, names: list[str]) -> list[str]:
         new_names = []
         for name in names:
@@ -361,8 +891,85 @@ class Data:
     
     @classmethod
     def from_dict(cls, data: dict) -> Data:
-        return Data(
+        return Data._trusted(
             games = [Game.from_dict(g) for g in data['games']],
             players = [Player.from_dict(p) for p in data['players']],
             aliases = data['aliases']
-        )
\ No newline at end of file
+        )
+
+    def to_bytes(self) -> bytes:
+        """
+        Compact binary format : one array per field, zlib compressed
+        Names are stored once in a table of json literals
+        """
+        values = {}
+        def value_id(value) -> int:
+            return values.setdefault((type(value), value), len(values))
+
+        columns = {name: [] for name in [
+            'player_name', 'base_elo', 'alias', 'alias_name',
+            'date', 'nb_players', 'game_players', 'end_points', 'nb_rounds',
+            'winner', 'discarder', 'hand_points', 'nb_penalties', 'penalty'
+        ]}
+        for p in self.players:
+            columns['player_name'].append(value_id(p.name))
+            columns['base_elo'].append(p.base_elo)
+        for alias, name in self.aliases.items():
+            columns['alias'].append(value_id(alias))
+            columns['alias_name'].append(value_id(name))
+        for game in self.games:
+            columns['date'].append((game.date - BINARY_EPOCH) // dt.timedelta(microseconds=1))
+            columns['nb_players'].append(len(game.players))
+            columns['game_players'] += [value_id(alias) for alias in game.players]
+            columns['end_points'] += game.end_points
+            columns['nb_rounds'].append(len(game.rounds))
+            for r in game.rounds:
+                columns['winner'].append(value_id(r.winner))
+                columns['discarder'].append(value_id(r.discarder))
+                columns['hand_points'].append(r.hand_points)
+                columns['nb_penalties'].append(len(r.penalties))
+                columns['penalty'] += r.penalties
+
+        literals = "\n".join(json.dumps(value) for _, value in values).encode()
+        arrays = [np.frombuffer(literals, np.uint8)]
+        for name, column in columns.items():
+            dtype = {'base_elo': np.float64, 'date': np.int64, 'end_points': np.int64}.get(name, np.int32)
+            arrays.append(np.array(column, dtype=dtype))
+        return BINARY_MAGIC + struct.pack("<I", BINARY_VERSION) + zlib.compress(_pack_arrays(arrays))
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> Data:
+        if payload[:4] != BINARY_MAGIC:
+            raise ValueError("Fichier binaire invalide")
+        version, = struct.unpack_from("<I", payload, 4)
+        if version != BINARY_VERSION:
+            raise ValueError(f"Version de fichier binaire inconnue : {version}")
+        arrays = _unpack_arrays(zlib.decompress(payload[8:]))
+        values = [_intern(json.loads(literal)) for literal in bytes(arrays[0]).decode().split("\n")] if arrays[0] else []
+        (player_name, base_elo, alias, alias_name,
+         date, nb_players, game_players, end_points, nb_rounds,
+         winner, discarder, hand_points, nb_penalties, penalty) = arrays[1:]
+
+        players = [Player(values[player_name[i]], base_elo[i]) for i in range(len(player_name))]
+        aliases = {values[alias[i]]: values[alias_name[i]] for i in range(len(alias))}
+        games = []
+        iplayer = 0
+        iround = 0
+        ipenalty = 0
+        for igame in range(len(date)):
+            rounds = []
+            for _ in range(nb_rounds[igame]):
+                next_ipenalty = ipenalty + nb_penalties[iround]
+                penalties = tuple(penalty[ipenalty:next_ipenalty])
+                ipenalty = next_ipenalty
+                rounds.append(Round._trusted(values[winner[iround]], values[discarder[iround]], hand_points[iround], penalties))
+                iround += 1
+            next_iplayer = iplayer + nb_players[igame]
+            games.append(Game._trusted(
+                players = tuple(values[id] for id in game_players[iplayer:next_iplayer]),
+                end_points = tuple(end_points[iplayer:next_iplayer]),
+                date = BINARY_EPOCH + dt.timedelta(microseconds=date[igame]),
+                rounds = rounds
+            ))
+            iplayer = next_iplayer
+        return Data._trusted(games, players, aliases)
\ No newline at end of file
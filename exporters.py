@@ -0,0 +1,132 @@
+from data import *
+from profiling import profiled
+import csv
+import io
+from bisect import bisect_left
+
+EXPORT_CHUNK_SIZE = 256 # Nombre de lignes ecrites d'un coup dans le fichier
+
+def iter_readable_elo(data: Data, start: dt.datetime|None = None, end: dt.datetime|None = None) -> Iterator[tuple[str, dict]]:
+    """
+    Entries of the readable elo history one game at a time : (date, entry)
+    Only the games with start <= date < end are given
+    """
+    first_game = 0 if start is None else bisect_left(data.games, start, key=lambda game: game.date)
+    last_game = len(data.games) if end is None else bisect_left(data.games, end, key=lambda game: game.date)
+    entries = data._iter_readable_elo_entries(first_game, last_game)
+    for igame in range(first_game, last_game):
+        yield (data.games[igame].date.isoformat(), next(entries))
+
+def iter_ema(data: Data, start: dt.datetime|None = None, end: dt.datetime|None = None) -> Iterator[tuple[int, dict]]:
+    """
+    EMA table one month at a time : (num_month, {joueur: stats_ema})
+    Only the months with games between start and end are given
+    """
+    first_month = 0 if start is None else start.year * 12 + start.month
+    last_month = None
+    if end is not None:
+        last_date = end - dt.timedelta(microseconds=1)
+        last_month = last_date.year * 12 + last_date.month
+    for imonth in range(len(data.ema)):
+        num_month = int(data.ema.months[imonth])
+        if first_month <= num_month and (last_month is None or num_month <= last_month):
+            yield data.ema[imonth]
+
+def last_entry_of_each_date(entries: Iterable[tuple[str, dict]]) -> Iterator[tuple[str, dict]]:
+    """ Games at the same date share their key in the json object, the last one is kept as in a dict """
+    previous = None
+    for date, entry in entries:
+        if previous is not None and previous[0] != date:
+            yield previous
+        previous = (date, entry)
+    if previous is not None:
+        yield previous
+
+def readable_elo_rows(entries: Iterable[tuple[str, dict]]) -> Iterator[list]:
+    """ One csv row per player of each game """
+    yield ['date', 'player', 'elo_before', 'elo', 'elo_gain', 'points', 'awaited_perf', 'elo_diff']
+    for date, entry in entries:
+        for name in entry['elo_gain']:
+            yield [
+                date, name, entry['elo_before'][name], entry['elo'][name], entry['elo_gain'][name],
+                entry['points'][name], entry['awaited_perf'][name], entry['elo_diff'][name]
+            ]
+
+def ema_rows(months: Iterable[tuple[int, dict]]) -> Iterator[list]:
+    """ One csv row per player of each month """
+    yield ['month', 'player'] + EMA_FIELDS
+    for num_month, ema_stats in months:
+        for name, stats in ema_stats.items():
+            yield [num_month, name] + [stats[field] for field in EMA_FIELDS]
+
+def write_chunked(lines: Iterable[str], file_path: str):
+    """ Writes the lines sequentially, EXPORT_CHUNK_SIZE at a time """
+    chunk = []
+    with open(file_path, "w", newline="") as f:
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) == EXPORT_CHUNK_SIZE:
+                f.write("".join(chunk))
+                chunk = []
+        f.write("".join(chunk))
+
+def json_object_lines(items: Iterable[tuple[str, object]]) -> Iterator[str]:
+    """ Same text as json.dump(dict(items), f, indent=4), one item at a time """
+    first = True
+    for key, value in items:
+        value_text = json.dumps(value, indent=4).replace("\n", "\n    ")
+        yield ("{\n" if first else ",\n") + f"    {json.dumps(key)}: {value_text}"
+        first = False
+    yield "{}" if first else "\n}"
+
+def json_array_lines(values: Iterable[object]) -> Iterator[str]:
+    """ Same text as json.dump(list(values), f, indent=4), one value at a time """
+    first = True
+    for value in values:
+        value_text = json.dumps(value, indent=4).replace("\n", "\n    ")
+        yield ("[\n" if first else ",\n") + f"    {value_text}"
+        first = False
+    yield "[]" if first else "\n]"
+
+def json_lines(values: Iterable[object]) -> Iterator[str]:
+    for value in values:
+        yield json.dumps(value) + "\n"
+
+def csv_lines(rows: Iterable[list]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+@profiled
+def export_readable_elo(data: Data, file_path: str, start: dt.datetime|None = None, end: dt.datetime|None = None):
+    """
+    Streams the readable elo history to 'file_path', format from its extension :
+    .jsonl (one game per line), .csv (one player of a game per line), else json
+    """
+    entries = iter_readable_elo(data, start, end)
+    if file_path.endswith(".jsonl"):
+        lines = json_lines({'date': date, **entry} for date, entry in entries)
+    elif file_path.endswith(".csv"):
+        lines = csv_lines(readable_elo_rows(entries))
+    else:
+        lines = json_object_lines(last_entry_of_each_date(entries))
+    write_chunked(lines, file_path)
+
+@profiled
+def export_ema(data: Data, file_path: str, start: dt.datetime|None = None, end: dt.datetime|None = None):
+    """
+    Streams the EMA table to 'file_path', format from its extension :
+    .jsonl (one month per line), .csv (one player of a month per line), else json
+    """
+    months = iter_ema(data, start, end)
+    if file_path.endswith(".jsonl"):
+        lines = json_lines({'month': num_month, 'stats': ema_stats} for num_month, ema_stats in months)
+    elif file_path.endswith(".csv"):
+        lines = csv_lines(ema_rows(months))
+    else:
+        lines = json_array_lines(months)
+    write_chunked(lines, file_path)
@@ -1,84 +1,267 @@
+import csv
 import json
+import numpy as np
 import pandas as pd # type: ignore
 from data import *
+from profiling import profiled
 import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 
-class DataLoader:
-    def __init__(self, data: Data):
-        self.data = data
+CSV_DATE_FORMAT = "%a %b %d %H:%M:%S GMT%z %Y"
 
+@lru_cache(maxsize=4096)
+def parse_csv_date(text: str) -> dt.datetime:
+    """ Date of the csv exports, with the timezone removed (local time kept) """
+    return dt.datetime.strptime(text, CSV_DATE_FORMAT).replace(tzinfo=None)
 
-    def load_game_csv(self, file_path: str) -> tuple[int, str]:
-        # Pretraitement
-        df = pd.read_csv(file_path)
-        df['Game start date'] = (
-            pd.to_datetime(
-                df['Game start date'],
-                format="%a %b %d %H:%M:%S GMT%z %Y",
-                errors="coerce"
-            )
-            .dt.tz_localize(None)      # remove timezone
-        )
-        df.columns = df.columns.str.removeprefix("Points ")
+def parse_game_csv(file_path: str) -> Game:
+    """
+    Reads the fixed layout of the csv exports row by row with the csv module
+    (one round row followed by one row of cumulated points)
+    Falls back on pandas if the file does not follow this layout
+    """
+    try:
+        with open(file_path, newline="", encoding="utf-8") as f:
+            rows = [row for row in csv.reader(f) if len(row) > 0]
+        columns = {name: i for i, name in enumerate(rows[0])}
+        names = [name.removeprefix("Points ") for name in rows[0][4:8]]
+        winner_col = columns['Winner']
+        discarder_col = columns['Discarder']
+        hand_points_col = columns['Hand Points']
+        penalty_cols = [columns['Penalty ' + name] for name in names]
 
-        # Extraction donnees base
-        date = df['Game start date'].iloc[0].to_pydatetime()
-        names = df.columns[4:8].tolist()
-        end_points = []
-        for name in names:
-            end_points.append(int(df[name].iloc[-1]))
-        
-        # Extraction rounds
+        date = parse_csv_date(rows[1][columns['Game start date']])
+        end_points = tuple(int(points) for points in rows[-1][4:8])
         rounds = []
-        for row_num in range(0, len(df), 2):
-            winner = df['Winner'].iloc[row_num]
+        for row in rows[1::2]:
+            winner = row[winner_col]
             if winner == "-":
                 winner = None
-            discarder = df['Discarder'].iloc[row_num]
+            discarder = row[discarder_col]
             if discarder == "-":
                 discarder = None
-            hand_points = df['Hand Points'].iloc[row_num]
-            penalties = {}
-            for name in names:
-                penalties[name] = df['Penalty ' + name].iloc[row_num]
-            rounds.append(Round(winner=winner, discarder=discarder, hand_points=hand_points, penalties=penalties))
-        
-        # Ajout partie
-        return self._try_to_add_game(names, end_points, date, rounds)
+            penalties = tuple(int(row[col]) for col in penalty_cols)
+            rounds.append(Round._trusted(winner, discarder, int(row[hand_points_col]), penalties))
+    except (ValueError, KeyError, IndexError):
+        return _parse_game_csv_pandas(file_path)
+    return Game._trusted(tuple(names), end_points, date, rounds)
+
+def _parse_game_csv_pandas(file_path: str) -> Game:
+    # Pretraitement
+    df = pd.read_csv(file_path)
+    df['Game start date'] = (
+        pd.to_datetime(
+            df['Game start date'],
+            format="%a %b %d %H:%M:%S GMT%z %Y",
+            errors="coerce"
+        )
+        .dt.tz_localize(None)      # remove timezone
+    )
+    df.columns = df.columns.str.removeprefix("Points ")
+
+    # Extraction donnees base
+    date = df['Game start date'].iloc[0].to_pydatetime()
+    names = df.columns[4:8].tolist()
+    end_points = []
+    for name in names:
+        end_points.append(int(df[name].iloc[-1]))
+    
+    # Extraction rounds
+    rounds = []
+    for row_num in range(0, len(df), 2):
+        winner = df['Winner'].iloc[row_num]
+        if winner == "-":
+            winner = None
+        discarder = df['Discarder'].iloc[row_num]
+        if discarder == "-":
+            discarder = None
+        hand_points = int(df['Hand Points'].iloc[row_num])
+        penalties = []
+        for name in names:
+            penalties.append(int(df['Penalty ' + name].iloc[row_num]))
+        rounds.append(Round._trusted(winner=winner, discarder=discarder, hand_points=hand_points, penalties=tuple(penalties)))
+    
+    return Game._trusted(tuple(names), tuple(end_points), date, rounds)
+
+def read_excel_sheets(file_path: str, sheet_names: list[str]) -> dict[str, np.ndarray]:
+    """
+    Cells of each sheet as a 2D object array, empty cells are None
+    The workbook is opened in read-only mode by openpyxl (also needed by pandas for .xlsx),
+    the values of the sheets are then loaded in memory
+    """
+    import openpyxl # type: ignore
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheets = {}
+        for name in sheet_names:
+            rows = [row for row in workbook[name].iter_rows(values_only=True)]
+            cells = np.full((len(rows), max([len(row) for row in rows], default=0)), None, dtype=object)
+            for row_num in range(len(rows)):
+                cells[row_num, :len(rows[row_num])] = rows[row_num]
+            sheets[name] = cells
+        return sheets
+    finally:
+        workbook.close()
+
+def parse_games_excel(file_path: str) -> tuple[list[Player], list[Game], list[str]]:
+    """
+    Reads the players of the sheet 'EMA points' and the games of the sheet
+    'Donnees', made of blocks of 4 rows : winds, names and date, scores, table points
+    All the rows and blocks are checked at once, empty rows and blocks without date are ignored
+    return (players, valid games, error message of each invalid row or block)
+    """
+    sheets = read_excel_sheets(file_path, ["Donnees", "EMA points"])
+    errors = []
+
+    # Chargement des joueurs (colonnes manquantes completees)
+    rows = sheets["EMA points"][2:]
+    player_rows = np.full((len(rows), 2), None, dtype=object)
+    player_rows[:, :min(rows.shape[1], 2)] = rows[:, :2]
+    player_names = pd.Series(player_rows[:, 0]).astype("string")
+    base_elos = pd.to_numeric(pd.Series(player_rows[:, 1]), errors="coerce").to_numpy(dtype=float)
+    missing_player_name = player_names.str.strip().fillna("").eq("").to_numpy()
+    missing_elo = pd.Series(player_rows[:, 1]).astype("string").str.strip().fillna("").eq("").to_numpy()
+    invalid_elo = np.isnan(base_elos)
+    for irow in np.flatnonzero((missing_player_name | invalid_elo) & ~(missing_player_name & missing_elo)).tolist():
+        reasons = []
+        if missing_player_name[irow]:
+            reasons.append("nom manquant")
+        if invalid_elo[irow]:
+            reasons.append("elo invalide")
+        errors.append(f"Joueur ligne {irow + 3} : {', '.join(reasons)}")
+    valid = np.flatnonzero(~missing_player_name & ~invalid_elo)
+    players = [Player(name, base_elo) for name, base_elo in zip(player_names.iloc[valid].tolist(), base_elos[valid].tolist())]
+
+    # Decoupage en blocs de 4 lignes (lignes et colonnes manquantes completees)
+    cells = sheets["Donnees"]
+    padded = np.full((len(cells) + (-len(cells)) % 4, max(cells.shape[1], 6)), None, dtype=object)
+    padded[:cells.shape[0], :cells.shape[1]] = cells
+    blocks = padded.reshape(-1, 4, padded.shape[1])
+    dates = blocks[:, 1, 5]
+    names = blocks[:, 1, 1:5]
+    scores = pd.to_numeric(pd.Series(blocks[:, 2, 1:5].ravel()), errors="coerce").to_numpy(dtype=float).reshape(-1, 4)
+
+    # Verification de tous les blocs
+    has_date = ~pd.isna(dates)
+    parsed_dates = pd.to_datetime(pd.Series(dates).astype(str), format="ISO8601", errors="coerce")
+    invalid_date = has_date & parsed_dates.isna().to_numpy()
+    missing_name = pd.isna(names).any(axis=1)
+    invalid_score = (np.isnan(scores) | (scores != np.round(scores))).any(axis=1)
+    for iblock in np.flatnonzero(has_date & (invalid_date | missing_name | invalid_score)).tolist():
+        reasons = []
+        if invalid_date[iblock]:
+            reasons.append("date invalide")
+        if missing_name[iblock]:
+            reasons.append("nom manquant")
+        if invalid_score[iblock]:
+            reasons.append("score invalide")
+        errors.append(f"Partie {iblock + 1} : {', '.join(reasons)}")
+
+    # Chargement des parties valides
+    valid = np.flatnonzero(has_date & ~invalid_date & ~missing_name & ~invalid_score)
+    games = []
+    for game_names, game_scores, date in zip(
+        names[valid].tolist(),
+        scores[valid].astype(np.int64).tolist(),
+        parsed_dates.iloc[valid].dt.to_pydatetime().tolist()
+    ):
+        games.append(Game._trusted(tuple(str(name) for name in game_names), tuple(game_scores), date, []))
+    return (players, games, errors)
+
+def parse_file(file_path: str) -> tuple[list[Player], list[Game], list[str]]:
+    """ Parses a file of the import folder, called in the worker processes of 'load_folder' """
+    if file_path.endswith(".xlsx"):
+        return parse_games_excel(file_path)
+    return ([], [parse_game_csv(file_path)], [])
+
+class DataLoader:
+    def __init__(self, data: Data):
+        self.data = data
+
+
+    @profiled
+    def load_game_csv(self, file_path: str) -> tuple[int, str]:
+        game = parse_game_csv(file_path)
+        return self._try_to_add_game(list(game.players), list(game.end_points), game.date, game.rounds)
     
 
+    @profiled
     def load_games_excel(self, file_path: str) -> tuple[int, str]:
-        xlsx = pd.ExcelFile(file_path)
-        df_games = pd.read_excel(xlsx, sheet_name="Donnees", header=None)
-        df_players = pd.read_excel(xlsx, sheet_name="EMA points", header=None)
-
-        # Chargement des joueurs
-        for row_num in range(2, len(df_players)):
-            name = str(df_players.iloc[row_num, 0])
-            base_elo = float(df_players.iloc[row_num, 1]) # type: ignore
-            self.data.add_player(Player(name, base_elo))
-
-        # Chargement des parties
-        for row_num in range(0, len(df_games), 4):
-            date_cell = df_games.iloc[row_num+1, 5]
-            if pd.isna(date_cell):
-                continue
-            date = dt.datetime.fromisoformat(str(date_cell))
-            player_names = []
-            player_scores = []
-            for wind in range(4):
-                name = str(df_games.iloc[row_num+1, 1 + wind])
-                score = int(df_games.iloc[row_num+2, 1 + wind]) # type: ignore
-                player_names.append(name)
-                player_scores.append(score)
-            err_code, err_mess = self.data.add_game(Game(player_names, player_scores, date))
-            if err_code != 0:
-                return (err_code, err_mess)
+        """
+        Adds the players and the games of the workbook in one batch
+        Every invalid block and every rejected game is reported, not only the first one
+        """
+        players, games, errors = parse_games_excel(file_path)
+        with self.data.ingest():
+            for player in players:
+                self.data.add_player(player)
+            results = self.data.add_games(games)
+
+        err_code = 6 if len(errors) > 0 else 0
+        nb_rejected = {}
+        for code, mess in results:
+            if code != 0:
+                if err_code == 0:
+                    err_code = code
+                nb_rejected[mess] = nb_rejected.get(mess, 0) + 1
+        for mess, nb in nb_rejected.items():
+            errors.append(f"{mess} ({nb} parties)")
+        return (err_code, " ; ".join(errors))
+
 
+    @profiled
+    def load_folder(self, folder_path: str, max_workers: int|None = None) -> dict[str, tuple[int, str]]:
+        """
+        Loads every csv and excel file of the folder in two steps : the files
+        are parsed in parallel processes, then all the games are added by date
+        order with a single Elo/EMA recomputation
+        Each unknown name of the csv files is asked only once
+        return the (err_code, err_mess) of each file, the first error for excel files
+        """
+        file_paths = []
+        for file in sorted(Path(folder_path).iterdir()):
+            if file.is_file() and file.suffix in [".csv", ".xlsx"]:
+                file_paths.append(str(file))
+        results = {}
+        parsed = {}
+        with ProcessPoolExecutor(max_workers) as pool:
+            futures = {file_path: pool.submit(parse_file, file_path) for file_path in file_paths}
+            for file_path, future in futures.items():
+                try:
+                    parsed[file_path] = future.result()
+                except Exception:
+                    results[file_path] = (5, "Fichier illisible")
+                    continue
+                if len(parsed[file_path][2]) > 0: # Blocs excel invalides
+                    results[file_path] = (6, " ; ".join(parsed[file_path][2]))
+
+        with self.data.ingest():
+            for players, games, errors in parsed.values():
+                for player in players:
+                    self.data.add_player(player)
 
-        return (0, "")
+            cancelled_names = set()
+            for file_path, (players, games, errors) in parsed.items():
+                if file_path.endswith(".csv"):
+                    for name in games[0].players:
+                        if not(name in cancelled_names) and not(self._resolve_name(name)):
+                            cancelled_names.add(name)
 
+            records = [(game, file_path) for file_path, (players, games, errors) in parsed.items() for game in games]
+            records.sort(key = lambda x : x[0])
+            for game, file_path in records:
+                if any(name in cancelled_names for name in game.players):
+                    result = (-1, "Annulation de l'ajout de la partie")
+                else:
+                    result = self.data.add_game(game)
+                if results.get(file_path, (0, ""))[0] == 0:
+                    results[file_path] = result
+        return results
 
+
+    @profiled
     def load_game_std_input(self) -> tuple[int, str]:
         verif = False
         while not(verif): 
@@ -93,17 +276,11 @@ class DataLoader:
     
 
     def remove_player(self, player_name: str) -> tuple[int, str]:
-        if not(player_name) in self.data.players:
+        if not(player_name in self.data.players):
             return (1, "Joueur inexistant")
         
-        games_to_remove = []
-        for igame in range(len(self.data.games)):
-            if player_name in self.data.games[igame].players:
-                games_to_remove.append(igame)
-        aliases_to_remove = []
-        for alias in self.data.aliases.keys():
-            if self.data.aliases[alias] == player_name:
-                aliases_to_remove.append(alias)
+        games_to_remove = self.data.games_of_player(player_name)
+        aliases_to_remove = self.data.aliases_of_player(player_name)
         
         print("Vous vous appretez a supprimer :")
         print(f"- les {len(games_to_remove)} parties de {player_name}")
@@ -118,36 +295,43 @@ class DataLoader:
     
     def _try_to_add_game(self, names: list[str], end_points: list[int], date: dt.datetime, rounds: list[Round]) -> tuple[int, str]:
         for name in names:
-            while not(name in self.data.aliases):
-                print(f"Joueur '{name}' inconnu.")
-                print("(1) Ajouter en tant que nouveau joueur")
-                print("(2) Ajouter en tant qu'alias pour un joueur existant")
-                print("(3) Annuler l'ajout de la partie")
-                choix = input()
-                try:
-                    choix = int(choix)
-                    if not(choix in [1, 2, 3]):
-                        continue
-                except:
+            if not(self._resolve_name(name)):
+                return (-1, "Annulation de l'ajout de la partie")
+        err_code, err_mess = self.data.add_game(Game._trusted(tuple(names), tuple(end_points), date, rounds))
+        return (err_code, err_mess)
+
+
+    def _resolve_name(self, name: str) -> bool:
+        """ Asks the user what to do with an unknown name, returns False if he cancels """
+        while not(name in self.data.aliases):
+            print(f"Joueur '{name}' inconnu.")
+            print("(1) Ajouter en tant que nouveau joueur")
+            print("(2) Ajouter en tant qu'alias pour un joueur existant")
+            print("(3) Annuler l'ajout de la partie")
+            choix = input()
+            try:
+                choix = int(choix)
+                if not(choix in [1, 2, 3]):
                     continue
-                if choix == 1:
-                    print("Elo pour le joueur : ", end="")
-                    elo = float(input())
-                    print("Nom officiel du joueur : ", end="")
-                    player_name = input()
-                    err_code, err_mess = self.data.add_player(Player(player_name, elo))
-                    if err_code == 0 and name != player_name:
-                        err_code, err_mess = self.data.add_alias(name, player_name)
-                elif choix == 2:
-                    print("Joueur dont c'est l'alias : ", end="")
-                    player_name = input()
+            except:
+                continue
+            if choix == 1:
+                print("Elo pour le joueur : ", end="")
+                elo = float(input())
+                print("Nom officiel du joueur : ", end="")
+                player_name = input()
+                err_code, err_mess = self.data.add_player(Player(player_name, elo))
+                if err_code == 0 and name != player_name:
                     err_code, err_mess = self.data.add_alias(name, player_name)
-                elif choix == 3:
-                    return (-1, "Annulation de l'ajout de la partie")
-                if err_code != 0:
-                    print("Erreur :", err_mess)
-        err_code, err_mess = self.data.add_game(Game(names, end_points, date, rounds))
-        return (err_code, err_mess)
+            elif choix == 2:
+                print("Joueur dont c'est l'alias : ", end="")
+                player_name = input()
+                err_code, err_mess = self.data.add_alias(name, player_name)
+            elif choix == 3:
+                return False
+            if err_code != 0:
+                print("Erreur :", err_mess)
+        return True
 
     
     def _read_game_input(self) -> tuple[list[str], list[int], dt.datetime]:
@@ -1,188 +1,215 @@
 from data import *
 from loaders import *
 from visualizer import *
+from storage import *
+from exporters import *
+from profiling import *
+from projection import *
+from tables import *
 from pathlib import Path
-import json
 from pprint import pprint
 import matplotlib.pyplot as plt
 
-DATA_SAVE_FILE = "./games.json"
+DATA_SAVE_FILE = "./games.bin" # Cree a partir de ./games.json s'il n'existe pas
 IMPORT_FOLDER = "./import_files/"
 
-data = Data()
-if Path(DATA_SAVE_FILE).exists():
-    with open(DATA_SAVE_FILE, "r") as f:
-        data_dict = json.load(f)
-        data = Data.from_dict(data_dict)
-loader = DataLoader(data)
-visualizer = Visualizer(data)
-# loader.load_games_excel(data, "./import_files/mahjong_elo.xlsx")
-# data.add_player(Player('Kevin', 1200))
-# data.add_player(Player('Christophe', 1000))
-# data.add_player(Player('Delphine', 1000))
-# data.add_player(Player('Ghislaine', 900))
-# data.add_player(Player('Guilhem', 1100))
-# data.add_alias('Kev', 'Kevin')
-# data.add_alias('Kevin 52', 'Kevin')
-# data.add_alias('Christophe 25', 'Christophe')
-# data.add_alias('Delphine 99', 'Delphine')
-# data.add_alias('Ghislaine 51', 'Ghislaine')
-# file_path = "import_files/04_10_2025 16_45.csv"
-# print(loader.load_game_csv(data, file_path))
-# print(loader.load_game_csv(data, file_path))
-# print(loader.load_game_std_input(data))
+def input_date_range() -> tuple[int, dt.datetime|None, dt.datetime|None]:
+    """ Asks for the first and the last days to export, both included (empty for no limit) """
+    try:
+        start = input("Date de debut (AAAA-MM-JJ, vide pour aucune) : ")
+        start = dt.datetime.fromisoformat(start) if start != "" else None
+        end = input("Date de fin (AAAA-MM-JJ, vide pour aucune) : ")
+        end = dt.datetime.fromisoformat(end) + dt.timedelta(days=1) if end != "" else None
+    except ValueError:
+        return (1, None, None)
+    return (0, start, end)
 
-continuer = True
-while continuer:
-    print("""
+# Garde necessaire aux processus de lecture de load_folder
+if __name__ == "__main__":
+    data = load_data(DATA_SAVE_FILE)
+    loader = DataLoader(data)
+    visualizer = Visualizer(data)
+    # loader.load_games_excel(data, "./import_files/mahjong_elo.xlsx")
+    # data.add_player(Player('Kevin', 1200))
+    # data.add_player(Player('Christophe', 1000))
+    # data.add_player(Player('Delphine', 1000))
+    # data.add_player(Player('Ghislaine', 900))
+    # data.add_player(Player('Guilhem', 1100))
+    # data.add_alias('Kev', 'Kevin')
+    # data.add_alias('Kevin 52', 'Kevin')
+    # data.add_alias('Christophe 25', 'Christophe')
+    # data.add_alias('Delphine 99', 'Delphine')
+    # data.add_alias('Ghislaine 51', 'Ghislaine')
+    # file_path = "import_files/04_10_2025 16_45.csv"
+    # print(loader.load_game_csv(data, file_path))
+    # print(loader.load_game_csv(data, file_path))
+    # print(loader.load_game_std_input(data))
+
+    continuer = True
+    while continuer:
+        print("""
         (1) Charger un fichier excel
         (2) Charger un fichier csv
         (3) Charger tous les fichiers dans import files
-        (4) Sauvegarder dans un fichier json
+        (4) Sauvegarder (binaire, ou json si le fichier finit par .json)
         (5) Afficher les elos
         (6) Afficher les emas
         (7) Stats speciales
         (8) Supprimer un joueur
         (9) Afficher la liste des joueurs
         (10) Terminal de commandes (dev only)
+        (11) Profilage (MAHJONG_PROFILE=1)
         (0) Quitter
-    """)
-    choix = int(input())
-    if choix == 1:
-        file_path = input("Entrez le nom du fichier excel : ")
-        err_code, err_mess = loader.load_games_excel(file_path)
-        if err_code != 0:
-            print("Erreur :", err_mess)
-    elif choix == 2:
-        file_path = input("Entrez le nom du fichier csv : ")
-        err_code, err_mess = loader.load_game_csv(file_path)
-        if err_code != 0:
-            print("Erreur :", err_mess)
-    elif choix == 3:
-        processed_files = []
-        for file in Path(IMPORT_FOLDER).iterdir():
-            if file.is_file():
-                if file.suffix == ".xlsx":
-                    print("Chargement fichier", file.name)
-                    err_code, err_mess = loader.load_games_excel(IMPORT_FOLDER + file.name)
-                    if err_code != 0:
-                        print("Erreur :", err_mess)
-                    else:
-                        processed_files.append(IMPORT_FOLDER + file.name)
-                if file.suffix == ".csv":
-                    print("Chargement fichier", file.name)
-                    err_code, err_mess = loader.load_game_csv(IMPORT_FOLDER + file.name)
-                    if err_code != 0:
-                        print("Erreur :", err_mess)
-                    if err_code == 0 or err_code == 1:
-                        processed_files.append(IMPORT_FOLDER + file.name)
-            if len(processed_files) % 10 == 0 and len(processed_files) > 0:
-                print("Sauvegarder l'avancement ? (y/n) ", end="")
-                choix = input().lower()
-                if choix == "y":
-                    with open(DATA_SAVE_FILE, "w") as f:
-                        json.dump(data.to_dict(), f, indent=4)
-                    for file_name in processed_files:
-                        os.remove(file_name)
-                    processed_files = []
-        for file_name in processed_files:
-            os.remove(file_name)
-    elif choix == 4:
-        file_path = input("Entrez le nom du fichier json (vide pour defaut) : ")
-        if file_path == "":
-            file_path = DATA_SAVE_FILE
-        with open(file_path, "w") as f:
-            json.dump(data.to_dict(), f, indent=4)
-    elif choix == 5:
-        players_per_plot = input("Entrez le nombre de joueur par graphe : ")
-        if players_per_plot == "":
-            players_per_plot = "6"
-        players_per_plot = int(players_per_plot)
-        save_path = input("Entrez le chemin d'enregistrement : ")
-        visualizer.plot_elos(players_per_plot, save_path)
-    elif choix == 6:
-        save_path = input("Entrez le chemin d'enregistrement : ")
-        visualizer.plot_emas(save_path)
-    elif choix == 7:
-        print("""
+        """)
+        choix = int(input())
+        if choix == 1:
+            file_path = input("Entrez le nom du fichier excel : ")
+            err_code, err_mess = loader.load_games_excel(file_path)
+            if err_code != 0:
+                print("Erreur :", err_mess)
+        elif choix == 2:
+            file_path = input("Entrez le nom du fichier csv : ")
+            err_code, err_mess = loader.load_game_csv(file_path)
+            if err_code != 0:
+                print("Erreur :", err_mess)
+        elif choix == 3:
+            processed_files = []
+            for file_path, (err_code, err_mess) in loader.load_folder(IMPORT_FOLDER).items():
+                print("Chargement fichier", Path(file_path).name)
+                if err_code != 0:
+                    print("Erreur :", err_mess)
+                if err_code == 0 or (err_code == 1 and file_path.endswith(".csv")):
+                    processed_files.append(file_path)
+            # Les parties acceptees sont deja dans le journal, la sauvegarde precede la suppression
+            save_data(data, DATA_SAVE_FILE)
+            for file_name in processed_files:
+                os.remove(file_name)
+        elif choix == 4:
+            file_path = input("Entrez le nom du fichier de sauvegarde (vide pour defaut) : ")
+            if file_path == "":
+                file_path = DATA_SAVE_FILE
+            save_data(data, file_path)
+        elif choix == 5:
+            players_per_plot = input("Entrez le nombre de joueur par graphe : ")
+            if players_per_plot == "":
+                players_per_plot = "6"
+            players_per_plot = int(players_per_plot)
+            save_path = input("Entrez le chemin d'enregistrement : ")
+            visualizer.plot_elos(players_per_plot, save_path)
+        elif choix == 6:
+            save_path = input("Entrez le chemin d'enregistrement : ")
+            visualizer.plot_emas(save_path)
+        elif choix == 7:
+            print("""
             (1) Stats par vent
             (2) Enregistrer elos
             (3) Enregistrer ema
             (4) Nombre de rencontres par joueur
             (5) Stats nemesis
-        """)
-        choix2 = int(input())
-        if choix2 == 1:
-            freqs = visualizer.calc_winning_wind_full_game()
-            def print_freqs(freq):
-                winds = ['East', 'South', 'West', 'North', 'Total']
-                places = ['1st', '2nd', '3rd', '4th']
-                for wind in range(len(winds)):
-                    print(f"\t{winds[wind]} : ", end="")
-                    for place in range(len(places)):
-                        if place != 0: print(", ", end="")
-                        print(f"{places[place]} : {freq[wind][place][0]} ({round(100*freq[wind][place][1], 1)}%)", end="")
+            (6) Projection EMA du mois en cours
+            (7) Composer les tables d'une soiree
+            """)
+            choix2 = int(input())
+            if choix2 == 1:
+                freqs = visualizer.calc_winning_wind_full_game()
+                def print_freqs(freq):
+                    winds = ['East', 'South', 'West', 'North', 'Total']
+                    places = ['1st', '2nd', '3rd', '4th']
+                    for wind in range(len(winds)):
+                        print(f"\t{winds[wind]} : ", end="")
+                        for place in range(len(places)):
+                            if place != 0: print(", ", end="")
+                            print(f"{places[place]} : {freq[wind][place][0]} ({round(100*freq[wind][place][1], 1)}%)", end="")
+                        print()
+                for p in data.players:
+                    print(p.name, ":")
+                    print_freqs(freqs[p.name])
+                print("TOTAL :")
+                print_freqs(freqs['total'])
+            elif choix2 == 2:
+                file_path = input("Entrez le nom du fichier ou enregistrer les elos (.json, .jsonl ou .csv) : ")
+                err_code, start, end = input_date_range()
+                if err_code != 0:
+                    print("Erreur : date invalide")
+                else:
+                    export_readable_elo(data, file_path, start, end)
+            elif choix2 == 3:
+                file_path = input("Entrez le nom du fichier ou enregistrer les emas (.json, .jsonl ou .csv) : ")
+                err_code, start, end = input_date_range()
+                if err_code != 0:
+                    print("Erreur : date invalide")
+                else:
+                    export_ema(data, file_path, start, end)
+            elif choix2 == 4:
+                counts = visualizer.calc_nb_encounters()
+                def print_counts(count):
+                    nb_prints = 0
+                    for p, val in dict(sorted(count.items(), key=lambda x: x[1], reverse=True)).items():
+                        if val > 0:
+                            print(f"\t{p} : {val}", end="\t")
+                            nb_prints += 1
+                            if nb_prints%4 == 0:
+                                print()
+                    if nb_prints%4 != 0: print()
+                for p, count in counts.items():
+                    print(f"Rencontres de {p} :")
+                    print_counts(count)
+            elif choix2 == 5:
+                stats = visualizer.calc_nemesis()
+                def print_nemesis(stat):
+                    nb_prints = 0
+                    for p, val in dict(sorted(stat.items(), key=lambda x: (x[1]['smoothed_rate'], x[1]['win_rate'], -x[1]['nb_total']), reverse=False)).items():
+                        if val['nb_total'] > 0:
+                            print(f"\t{p} : {val['nb_wins']:.0f}/{val['nb_total']:.0f} ({100 * val['win_rate']:.1f}%)", end="\t")
+                            nb_prints += 1
+                            if nb_prints%3 == 0:
+                                print()
+                    if nb_prints%4 != 0: print()
+                for p, stat in stats.items():
+                    print(f"Taux de victoire de {p} :")
+                    print()
+                    print_nemesis(stat)
                     print()
-            for p in data.players:
-                print(p.name, ":")
-                print_freqs(freqs[p.name])
-            print("TOTAL :")
-            print_freqs(freqs['total'])
-        elif choix2 == 2:
-            file_path = input("Entrez le nom du fichier ou enregistrer les elos : ")
-            with open(file_path, "w") as f:
-                json.dump(data._get_readable_elo_dict(), f, indent=4)
-        elif choix2 == 3:
-            file_path = input("Entrez le nom du fichier ou enregistrer les emas : ")
-            with open(file_path, "w") as f:
-                json.dump(data.ema, f, indent=4)
-        elif choix2 == 4:
-            counts = visualizer.calc_nb_encounters()
-            def print_counts(count):
-                nb_prints = 0
-                for p, val in dict(sorted(count.items(), key=lambda x: x[1], reverse=True)).items():
-                    if val > 0:
-                        print(f"\t{p} : {val}", end="\t")
-                        nb_prints += 1
-                        if nb_prints%4 == 0:
-                            print()
-                if nb_prints%4 != 0: print()
-            for p, count in counts.items():
-                print(f"Rencontres de {p} :")
-                print_counts(count)
-        elif choix2 == 5:
-            stats = visualizer.calc_nemesis()
-            def print_nemesis(stat):
-                nb_prints = 0
-                for p, val in dict(sorted(stat.items(), key=lambda x: (x[1]['smoothed_rate'], x[1]['win_rate'], -x[1]['nb_total']), reverse=False)).items():
-                    if val['nb_total'] > 0:
-                        print(f"\t{p} : {val['nb_wins']:.0f}/{val['nb_total']:.0f} ({100 * val['win_rate']:.1f}%)", end="\t")
-                        nb_prints += 1
-                        if nb_prints%3 == 0:
-                            print()
-                if nb_prints%4 != 0: print()
-            for p, stat in stats.items():
-                print(f"Taux de victoire de {p} :")
-                print()
-                print_nemesis(stat)
-                print()
-    elif choix == 8:
-        player_name = input("Entrez le nom du joueur a supprimer : ")
-        err_code, err_mess = loader.remove_player(player_name)
-        if err_code != 0:
-            print("Erreur :", err_mess)
-    elif choix == 9:
-        visualizer.print_players()
-    elif choix == 10:
-        commands = []
-        while True:
-            comm = input("> ")
-            if comm == "quit":
-                break
-            commands.append(comm)
-            exec(comm)
-    elif choix == 0:
-        continuer = False
+            elif choix2 == 6:
+                remaining_games = input("Nombre de parties restantes dans le mois (vide pour estimer) : ")
+                remaining_games = float(remaining_games) if remaining_games != "" else None
+                projection = project_month_ema(data, remaining_games=remaining_games)
+                for p, stats in sorted(projection.items(), key=lambda x: x[1]['mean_rank']):
+                    best_ranks = sorted(stats['rank_probs'].items(), key=lambda x: x[1], reverse=True)[:3]
+                    print(
+                        f"\t{p} : rang moyen {stats['mean_rank']:.1f} (classe {100 * stats['ranked_rate']:.0f}%), "
+                        f"gain {stats['gain_p10']:.0f} / {stats['gain_p50']:.0f} / {stats['gain_p90']:.0f}, "
+                        + ", ".join(f"{rank}e {100 * prob:.0f}%" for rank, prob in best_ranks)
+                    )
+            elif choix2 == 7:
+                attendees = input("Entrez les joueurs presents, separes par des virgules : ")
+                err_code, err_mess, tables = assign_tables(data, visualizer, [name.strip() for name in attendees.split(",") if name.strip() != ""])
+                if err_code != 0:
+                    print("Erreur :", err_mess)
+                elos = get_current_elos(data)
+                for itable, table in enumerate(tables):
+                    print(f"\tTable {itable + 1} : " + ", ".join(f"{name} ({elos[data.name_to_player_id[name]]:.0f})" for name in table))
+        elif choix == 8:
+            player_name = input("Entrez le nom du joueur a supprimer : ")
+            err_code, err_mess = loader.remove_player(player_name)
+            if err_code != 0:
+                print("Erreur :", err_mess)
+        elif choix == 9:
+            visualizer.print_players()
+        elif choix == 10:
+            commands = []
+            while True:
+                comm = input("> ")
+                if comm == "quit":
+                    break
+                commands.append(comm)
+                exec(comm)
+            # Les modifications directes ne sont pas dans le journal : sauvegarde complete
+            save_data(data, DATA_SAVE_FILE, compact=True)
+        elif choix == 11:
+            print(get_profile_summary())
+        elif choix == 0:
+            continuer = False
 
-with open(DATA_SAVE_FILE, "w") as f:
-    json.dump(data.to_dict(), f, indent=4)
\ No newline at end of file
+    save_data(data, DATA_SAVE_FILE)
+    write_profile_summary()
\ No newline at end of file
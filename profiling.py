@@ -0,0 +1,86 @@
+import functools
+import numpy as np
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+# Active si la variable d'environnement MAHJONG_PROFILE vaut autre chose que "" ou "0"
+# Desactive, 'profiled' rend la fonction telle quelle : aucun cout a l'execution
+PROFILING_ENABLED = os.environ.get("MAHJONG_PROFILE", "") not in ["", "0"]
+PROFILE_OUTPUT_FILE = "./profile_output.txt"
+
+class CallStats:
+    """ Durations and memory of every call of one profiled function """
+    def __init__(self):
+        self.durations = []
+        self.allocated = 0 # Memoire restee allouee apres les appels, cumulee
+        self.peak = 0 # Plus grand pic de memoire d'un appel
+
+    def add(self, duration: float, allocated: int, peak: int):
+        self.durations.append(duration)
+        self.allocated += allocated
+        self.peak = max(self.peak, peak)
+
+profile_stats = {}
+memory_stack = [] # [memoire au debut, pic vu par les appels internes] des appels en cours
+
+def profiled(func: Callable) -> Callable:
+    """ Records the calls of 'func' in profile_stats when profiling is enabled """
+    if not(PROFILING_ENABLED):
+        return func
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with profile_block(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+@contextmanager
+def profile_block(name: str) -> Iterator[None]:
+    """ Records the duration and the memory of the block under 'name' when profiling is enabled """
+    if not(PROFILING_ENABLED):
+        yield
+        return
+    if not(tracemalloc.is_tracing()):
+        tracemalloc.start()
+
+    # Le pic de tracemalloc est remis a zero pour chaque appel, celui de l'appel englobant est conserve
+    current, peak = tracemalloc.get_traced_memory()
+    if len(memory_stack) > 0:
+        memory_stack[-1][1] = max(memory_stack[-1][1], peak)
+    tracemalloc.reset_peak()
+    memory_stack.append([current, current])
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start_time
+        current, peak = tracemalloc.get_traced_memory()
+        start_memory, inner_peak = memory_stack.pop()
+        peak = max(peak, inner_peak)
+        if len(memory_stack) > 0:
+            memory_stack[-1][1] = max(memory_stack[-1][1], peak)
+        profile_stats.setdefault(name, CallStats()).add(duration, current - start_memory, peak - start_memory)
+
+def get_profile_summary() -> str:
+    """ One line per profiled function, by decreasing total time """
+    if not(PROFILING_ENABLED):
+        return "Profilage desactive (MAHJONG_PROFILE=1 pour l'activer)"
+    lines = [f"{'Fonction':40} {'Appels':>8} {'Total s':>10} {'Moy ms':>10} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} {'Alloue Mo':>10} {'Pic Mo':>10}"]
+    for name, stats in sorted(profile_stats.items(), key=lambda x: sum(x[1].durations), reverse=True):
+        durations = np.array(stats.durations) * 1000
+        p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+        lines.append(
+            f"{name:40} {len(durations):8d} {durations.sum() / 1000:10.3f} {durations.mean():10.3f} "
+            f"{p50:10.3f} {p90:10.3f} {p99:10.3f} {stats.allocated / 2**20:10.2f} {stats.peak / 2**20:10.2f}"
+        )
+    return "\n".join(lines)
+
+def write_profile_summary(file_path: str = PROFILE_OUTPUT_FILE):
+    if not(PROFILING_ENABLED):
+        return
+    with open(file_path, "w") as f:
+        f.write(get_profile_summary() + "\n")
@@ -0,0 +1,136 @@
+from data import *
+from profiling import profiled
+import calendar
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+PROJECTION_SAMPLES = 100000
+PROJECTION_BATCH_SIZE = 20000 # Mois simules ensemble, borne la memoire des tableaux (simulations x joueurs)
+PROJECTION_HISTORY_GAMES = 200 # Parties recentes donnant la frequence de jeu de chaque joueur
+PROJECTION_MIN_PARALLEL = 2 # Nombre de lots a partir duquel ils sont repartis entre processus
+
+def get_month_state(data: Data, date: dt.datetime) -> dict:
+    """
+    State of the month of 'date' : elo and nb games of every player, games played
+    in the month up to 'date', play frequency of each player and expected nb of remaining games
+    The players are in the order of data.players, by name like the ties of the EMA ranking
+    """
+    order = list(data.elo.columns.values())
+    month_start = dt.datetime(date.year, date.month, 1)
+    first_game = bisect_left(data.games, month_start, key=lambda game: game.date)
+    last_game = bisect_right(data.games, date, key=lambda game: game.date) - 1
+    nb_games = data.nb_games.row(last_game)[order]
+    month_games = nb_games - (data.nb_games.row(first_game - 1)[order] if first_game > 0 else 0)
+
+    # Parties par jour ecoule du mois, prolongees jusqu'a la fin du mois. Sans partie dans le mois,
+    # le rythme est celui du dernier mois joue
+    nb_days = calendar.monthrange(date.year, date.month)[1]
+    if last_game >= first_game:
+        games_per_day = (last_game + 1 - first_game) / date.day
+    else:
+        last_date = data.games[last_game].date
+        last_month_start = bisect_left(data.games, dt.datetime(last_date.year, last_date.month, 1), key=lambda game: game.date)
+        games_per_day = (last_game + 1 - last_month_start) / calendar.monthrange(last_date.year, last_date.month)[1]
+    recent_ids = np.array([game.player_ids for game in data.games[max(last_game + 1 - PROJECTION_HISTORY_GAMES, 0):last_game + 1]], dtype=np.int64)
+    return {
+        'num_month': date.year * 12 + date.month,
+        'elo': data.elo.row(last_game)[order],
+        'nb_games': nb_games,
+        'month_games': month_games,
+        'weights': np.bincount(recent_ids.ravel(), minlength=len(data.player_by_id))[order].astype(np.float64),
+        'remaining_games': games_per_day * (nb_days - date.day)
+    }
+
+def gumbel(rng: np.random.Generator, shape: tuple[int, ...]) -> np.ndarray:
+    """ Gumbel noise in float32 (minus the log of an exponential), several times faster than rng.gumbel """
+    with np.errstate(divide='ignore'): # Une exponentielle nulle donne un bruit infini, tire avant tous les autres
+        return -np.log(rng.standard_exponential(shape, dtype=np.float32))
+
+def simulate_month(state: dict, nb_samples: int, seed: np.random.SeedSequence) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Plays the rest of the month 'nb_samples' times at once, the simulations are the first axis
+    Each simulation draws its nb of games (Poisson), the tables by play frequency, and the places
+    from the elos : with a Gumbel noise on elo * ln(10) / ELO_DIFF_SCALING, the probability
+    that a seat finishes before another is the one of 'expected_points'
+    return (EMA rank, ema gain) of each player in each simulation, rank -1 if inactive
+    """
+    rng = np.random.default_rng(seed)
+    candidates = np.flatnonzero(state['weights'] > 0)
+    log_weights = np.log(state['weights'][candidates]).astype(np.float32)
+    elos = np.tile(state['elo'], (nb_samples, 1))
+    nb_games = np.tile(state['nb_games'], (nb_samples, 1))
+    month_games = np.tile(state['month_games'], (nb_samples, 1))
+    nb_remaining = rng.poisson(state['remaining_games'], nb_samples)
+    samples = np.arange(nb_samples)[:, None]
+
+    for igame in range(nb_remaining.max(initial=0) if len(candidates) >= 4 else 0):
+        playing = (nb_remaining > igame)[:, None]
+        # Tables tirees sans remise selon la frequence de jeu (Gumbel top-k)
+        keys = log_weights + gumbel(rng, (nb_samples, len(candidates)))
+        seats = candidates[np.argpartition(-keys, 3, axis=1)[:, :4]]
+        seat_elos = elos[samples, seats]
+        perfs = seat_elos * (np.log(10) / ELO_DIFF_SCALING) + gumbel(rng, (nb_samples, 4))
+        points = perfs.argsort(axis=1).argsort(axis=1) # 0 pour le dernier, 3 pour le premier
+
+        win = 1.0 / (1.0 + 10 ** ((seat_elos[:, None, :] - seat_elos[:, :, None]) / ELO_DIFF_SCALING))
+        expected = win.sum(axis=2) - 0.5
+        seat_nb_games = nb_games[samples, seats]
+        coef = ELO_K + ELO_K_NEWBIE_ADD / (ELO_K_NEWBIE_SCALE + seat_nb_games)
+        elos[samples, seats] = seat_elos + playing * coef * (points - expected)
+        nb_games[samples, seats] = seat_nb_games + playing
+        month_games[samples, seats] += playing
+
+    # Classement de fin de mois comme dans '_update_ema' : a elo egal par nom, les inactifs en tete du tri
+    active = month_games > 0
+    nb_active = active.sum(axis=1, keepdims=True)
+    order = np.where(active, elos, -np.inf).argsort(axis=1, kind='stable')
+    pos = np.empty_like(order)
+    pos[samples, order] = np.arange(elos.shape[1]) - (elos.shape[1] - nb_active)
+    ranks = np.where(active, nb_active - pos, -1)
+    gains = np.where(active, (np.minimum(month_games, EMA_MIN_GAMES_PER_MONTH) / EMA_MIN_GAMES_PER_MONTH) *
+                     (EMA_MIN_GAIN + (EMA_MAX_GAIN - EMA_MIN_GAIN) * (pos / np.maximum(nb_active - 1, 1))), 0.0)
+    return (ranks, gains)
+
+@profiled
+def project_month_ema(data: Data, nb_samples: int = PROJECTION_SAMPLES, remaining_games: float|None = None, seed: int = 0, max_workers: int|None = None, date: dt.datetime|None = None) -> dict:
+    """
+    Distribution of the EMA rank and gain of each player at the end of the month of 'date' (now by default),
+    the games played after 'date' are ignored
+    'remaining_games' is the average nb of games left in the month, estimated from the games already played by default
+    return {player name: stats}, players without any chance to be ranked are left out
+    """
+    date = date or dt.datetime.now()
+    if len(data.games) == 0 or data.games[0].date > date:
+        return {}
+    state = get_month_state(data, date)
+    if remaining_games is not None:
+        state['remaining_games'] = remaining_games
+
+    batch_sizes = [min(PROJECTION_BATCH_SIZE, nb_samples - i) for i in range(0, nb_samples, PROJECTION_BATCH_SIZE)]
+    seeds = np.random.SeedSequence(seed).spawn(len(batch_sizes))
+    nb_workers = min(max_workers or os.cpu_count() or 1, len(batch_sizes))
+    if nb_workers <= 1 or len(batch_sizes) < PROJECTION_MIN_PARALLEL:
+        batches = [simulate_month(state, size, batch_seed) for size, batch_seed in zip(batch_sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(nb_workers) as pool:
+            batches = list(pool.map(simulate_month, [state] * len(batch_sizes), batch_sizes, seeds))
+    ranks = np.concatenate([batch[0] for batch in batches])
+    gains = np.concatenate([batch[1] for batch in batches])
+
+    projection = {}
+    for id, p in enumerate(data.players):
+        ranked = ranks[:, id] > 0
+        if not(ranked.any()):
+            continue
+        rank_counts = np.bincount(ranks[ranked, id])
+        p10, p50, p90 = np.percentile(gains[:, id], [10, 50, 90])
+        projection[p.name] = {
+            'ranked_rate': float(ranked.mean()),
+            'rank_probs': {rank: count / nb_samples for rank, count in enumerate(rank_counts.tolist()) if count > 0},
+            'mean_rank': float(ranks[ranked, id].mean()),
+            'mean_gain': float(gains[:, id].mean()),
+            'gain_p10': float(p10),
+            'gain_p50': float(p50),
+            'gain_p90': float(p90)
+        }
+    return projection
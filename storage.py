@@ -0,0 +1,141 @@
+from data import *
+from profiling import profiled
+import os
+from pathlib import Path
+
+JOURNAL_MAX_ENTRIES = 1000 # Au dela, la sauvegarde suivante reecrit tout le fichier binaire
+
+class Journal:
+    """
+    Append-only file of the mutations done since the last binary save (json lines)
+    The first line holds the crc32 of that save, so a journal left behind by
+    an interrupted save is recognized as outdated and ignored
+    """
+    def __init__(self, file_path: str, nb_entries: int = 0):
+        self.file_path = file_path
+        self.nb_entries = nb_entries
+        self.file = open(file_path, "a")
+
+    @classmethod
+    def create(cls, file_path: str, save_crc: int) -> 'Journal':
+        """ Empty journal of the save 'save_crc', replaces the file atomically """
+        tmp_path = file_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps({'save_crc': save_crc}) + "\n")
+        os.replace(tmp_path, file_path)
+        return cls(file_path)
+
+    @classmethod
+    def reopen(cls, file_path: str, save_crc: int) -> tuple['Journal', list[dict]]:
+        """
+        Reopens the journal of the save 'save_crc' without rewriting it, the entries already
+        present are returned to be replayed. A missing or outdated journal is created again
+        """
+        entries, valid_size = cls.read_entries(file_path, save_crc)
+        if valid_size == 0:
+            return (cls.create(file_path, save_crc), [])
+        if os.path.getsize(file_path) > valid_size:
+            os.truncate(file_path, valid_size) # Derniere ligne tronquee par un arret brutal
+        return (cls(file_path, len(entries)), entries)
+
+    def append(self, entry: dict):
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush() # Une partie acceptee survit a un arret brutal du programme
+        self.nb_entries += 1
+
+    def sync(self):
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+    @classmethod
+    def read_entries(cls, file_path: str, save_crc: int) -> tuple[list[dict], int]:
+        """
+        Entries of the journal that apply to the save 'save_crc', and the size in bytes
+        of the complete lines that hold them (0 if the journal is missing or outdated)
+        """
+        if not(Path(file_path).exists()):
+            return ([], 0)
+        with open(file_path, "rb") as f:
+            lines = f.read().split(b"\n")
+        entries = []
+        valid_size = 0
+        try:
+            if len(lines) < 2 or json.loads(lines[0])['save_crc'] != save_crc:
+                return ([], 0)
+            valid_size = len(lines[0]) + 1
+            for line in lines[1:-1]: # Le dernier morceau n'a pas de fin de ligne : vide ou tronque
+                entries.append(json.loads(line))
+                valid_size += len(line) + 1
+        except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError): # Ligne tronquee
+            pass
+        return (entries, valid_size)
+
+@profiled
+def load_data(file_path: str, read_only: bool = False) -> Data:
+    """
+    Loads the binary save, or a json save depending on the file extension
+    The journal of the binary save is replayed on top of it, and stays
+    attached to the returned data to record the next mutations
+    If the binary save does not exist yet, it is created from the json
+    save with the same name (automatic migration)
+    With 'read_only', no file is written and no journal is attached, so
+    another program can keep the save open (tuning, benchmark)
+    """
+    path = Path(file_path)
+    if path.suffix == ".json":
+        with open(path, "r") as f:
+            return Data.from_dict(json.load(f))
+    if not(path.exists()):
+        json_path = path.with_suffix(".json")
+        data = Data()
+        if json_path.exists():
+            data = load_data(str(json_path))
+        if not(read_only):
+            save_data(data, file_path)
+        return data
+
+    with open(path, "rb") as f:
+        payload = f.read()
+    data = Data.from_bytes(payload)
+    save_crc = zlib.crc32(payload)
+    if read_only:
+        entries = Journal.read_entries(file_path + ".journal", save_crc)[0]
+    else:
+        journal, entries = Journal.reopen(file_path + ".journal", save_crc)
+    with data.ingest():
+        for entry in entries:
+            data.apply_journal_entry(entry)
+    if not(read_only):
+        data.journal = journal
+    return data
+
+@profiled
+def save_data(data: Data, file_path: str, compact: bool = False):
+    """
+    Saves in json if the file extension is .json, else in binary
+    When the data journal belongs to this binary save, its mutations are
+    already on disk : the full file is only rewritten when the journal is long,
+    or with 'compact' after changes made without the methods of Data
+    """
+    path = Path(file_path)
+    if path.suffix == ".json":
+        with open(path, "w") as f:
+            json.dump(data.to_dict(), f, indent=4)
+        return
+    journal_path = file_path + ".journal"
+    if data.journal is not None and data.journal.file_path == journal_path and data.journal.nb_entries < JOURNAL_MAX_ENTRIES and not(compact):
+        data.journal.sync()
+        return
+
+    # Ecriture dans un fichier temporaire pour ne pas corrompre la sauvegarde
+    payload = data.to_bytes()
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(payload)
+    tmp_path.replace(path)
+    if data.journal is None or data.journal.file_path == journal_path:
+        if data.journal is not None:
+            data.journal.close()
+        data.journal = Journal.create(journal_path, zlib.crc32(payload))
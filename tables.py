@@ -0,0 +1,111 @@
+from data import *
+from visualizer import Visualizer
+from profiling import profiled
+
+TABLES_BALANCE_WEIGHT = 10.0 # Poids de l'ecart a 50% de la probabilite de victoire de chaque paire
+TABLES_ENCOUNTER_WEIGHT = 1.0 # Poids des rencontres passees, relatives au maximum parmi les presents
+TABLES_RECENT_WEIGHT = 2.0 # Poids de chaque partie jouee ensemble recemment
+TABLES_RECENT_DAYS = 28
+TABLES_NB_RESTARTS = 48 # Descentes : depart aleatoire une fois sur deux, sinon la meilleure repartition perturbee
+TABLES_NB_PERTURBATIONS = 3 # Echanges aleatoires appliques a la meilleure repartition
+
+def get_current_elos(data: Data) -> np.ndarray:
+    """ Elo of each player id after the last game """
+    return data.elo.row(-1) if len(data.games) > 0 else np.array([p.base_elo for p in data.player_by_id])
+
+def get_pair_costs(data: Data, visualizer: Visualizer, ids: list[int]) -> np.ndarray:
+    """
+    Cost tab [i][j] of seating the players ids[i] and ids[j] at the same table :
+    unbalanced pair, many encounters, games played together recently
+    """
+    seat_elos = get_current_elos(data)[ids]
+    win = 1.0 / (1.0 + 10 ** ((seat_elos[None, :] - seat_elos[:, None]) / ELO_DIFF_SCALING))
+
+    encounters = visualizer.get_encounter_matrix()[np.ix_(ids, ids)].astype(np.float64)
+    np.fill_diagonal(encounters, 0)
+
+    recent = np.zeros((len(data.player_by_id), len(data.player_by_id)))
+    if len(data.games) > 0:
+        first_game = bisect_left(data.games, data.games[-1].date - dt.timedelta(days=TABLES_RECENT_DAYS), key=lambda game: game.date)
+        game_ids = np.array([game.player_ids for game in data.games[first_game:]], dtype=np.int64).reshape(-1, 4)
+        winds_1, winds_2 = np.nonzero(~np.eye(4, dtype=bool))
+        np.add.at(recent, (game_ids[:, winds_1].ravel(), game_ids[:, winds_2].ravel()), 1)
+
+    costs = (
+        TABLES_BALANCE_WEIGHT * (win - 0.5)**2 +
+        TABLES_ENCOUNTER_WEIGHT * encounters / max(encounters.max(), 1) +
+        TABLES_RECENT_WEIGHT * recent[np.ix_(ids, ids)]
+    )
+    np.fill_diagonal(costs, 0)
+    return costs
+
+def get_tables_cost(costs: np.ndarray, tables: np.ndarray) -> float:
+    """ Sum of the costs of the pairs seated at the same table """
+    same_table = tables[:, None] == tables[None, :]
+    return float(costs[same_table].sum() / 2)
+
+def local_search(costs: np.ndarray, tables: np.ndarray) -> np.ndarray:
+    """
+    Swaps the two players of different tables that lower the cost the most, until no swap does
+    tables[i] is the table of the player i, modified in place
+    """
+    nb_players = len(tables)
+    players = np.arange(nb_players)
+    # table_costs[i][t] : cout du joueur i avec les joueurs de la table t
+    table_costs = costs @ np.eye(tables.max() + 1)[tables]
+    while True:
+        own = table_costs[players, tables]
+        cross = table_costs[:, tables] # cross[j][i] : cout du joueur j a la table du joueur i
+        deltas = cross.T + cross - own[:, None] - own[None, :] - 2 * costs
+        deltas[tables[:, None] == tables[None, :]] = 0
+        i, j = divmod(int(deltas.argmin()), nb_players)
+        if deltas[i, j] >= -1e-9:
+            return tables
+        table_i, table_j = tables[i], tables[j]
+        table_costs[:, table_i] += costs[:, j] - costs[:, i]
+        table_costs[:, table_j] += costs[:, i] - costs[:, j]
+        tables[i], tables[j] = table_j, table_i
+
+@profiled
+def assign_tables(data: Data, visualizer: Visualizer, attendees: list[str], seed: int = 0) -> tuple[int, str, list[list[str]]]:
+    """
+    Splits the players present (names or aliases) into tables of 4 with balanced elos
+    and few repeated pairings : iterated local search over the swaps of two players
+    return (err_code, err_mess, tables of player names by decreasing elo)
+    """
+    names = []
+    for name in attendees:
+        name = data.aliases.get(name, name)
+        if not(name in data.name_to_player_id):
+            return (1, f"Joueur inconnu : {name}", [])
+        if name in names:
+            return (1, f"Joueur present deux fois : {name}", [])
+        names.append(name)
+    if len(names) == 0 or len(names) % 4 != 0:
+        return (1, f"{len(names)} joueurs : il en faut un multiple de 4", [])
+
+    ids = [data.name_to_player_id[name] for name in names]
+    costs = get_pair_costs(data, visualizer, ids)
+    rng = np.random.default_rng(seed)
+    best_tables = None
+    best_cost = np.inf
+    for restart in range(TABLES_NB_RESTARTS):
+        if best_tables is None or restart % 2 == 0:
+            tables = rng.permutation(len(names)) // 4
+        else:
+            tables = best_tables.copy()
+            for k in range(TABLES_NB_PERTURBATIONS):
+                i, j = rng.choice(len(names), 2, replace=False)
+                tables[i], tables[j] = tables[j], tables[i]
+        tables = local_search(costs, tables)
+        cost = get_tables_cost(costs, tables)
+        if cost < best_cost:
+            best_tables = tables.copy()
+            best_cost = cost
+
+    elos = get_current_elos(data)
+    result = [[] for t in range(len(names) // 4)]
+    for i in sorted(range(len(names)), key=lambda i: elos[ids[i]], reverse=True):
+        result[best_tables[i]].append(names[i])
+    result.sort(key=lambda table: elos[data.name_to_player_id[table[0]]], reverse=True)
+    return (0, "", result)
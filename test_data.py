@@ -0,0 +1,85 @@
+from data import *
+from data import _pack_arrays, _unpack_arrays
+import random
+
+def make_tournament(nb_games: int = 300, nb_players: int = 12, seed: int = 0) -> tuple[list[Player], dict[str, str], list[Game]]:
+    """ Random games of 4 players over a few months, each player with one extra alias """
+    rng = random.Random(seed)
+    players = [Player(f"Joueur {i:02d}", 900 + 20 * i) for i in range(nb_players)]
+    aliases = {}
+    for p in players:
+        aliases[p.name] = p.name
+        aliases[p.name + " bis"] = p.name
+    games = []
+    for igame in range(nb_games):
+        names = [rng.choice([p.name, p.name + " bis"]) for p in rng.sample(players, 4)]
+        end_points = [rng.randint(-100, 100) for i in range(3)]
+        end_points.append(-sum(end_points))
+        date = dt.datetime(2025, 1, 1) + dt.timedelta(hours=7 * igame + rng.randint(0, 6))
+        games.append(Game(names, end_points, date))
+    return (players, aliases, games)
+
+def assert_same_results(data: Data, expected: Data):
+    assert data.games == expected.games
+    for igame in range(len(expected.games)):
+        assert data.elo[igame] == expected.elo[igame]
+        assert data.nb_games[igame] == expected.nb_games[igame]
+    assert list(data.ema) == list(expected.ema)
+    assert data._get_readable_elo_dict() == expected._get_readable_elo_dict()
+
+def test_games_out_of_order_match_full_recompute():
+    players, aliases, games = make_tournament()
+    data = Data(players=players, aliases=aliases)
+    shuffled = list(games)
+    random.Random(1).shuffle(shuffled)
+    for game in shuffled[:len(games) // 2]: # Une par une, la plupart antidatees
+        assert data.add_game(game) == (0, "")
+    assert all(code == 0 for code, mess in data.add_games(shuffled[len(games) // 2:]))
+    assert_same_results(data, Data.from_dict(data.to_dict()))
+
+def test_add_player_does_not_replay_history():
+    players, aliases, games = make_tournament()
+    data = Data(games, players, aliases)
+    version = data.version
+    assert data.add_player(Player("Aaron", 1000)) == (0, "")
+    assert data.add_player(Player("Zoe", 1100)) == (0, "")
+    assert not(any(kind == 'recompute' for kind, obj in data.changes_since(version)))
+    assert data.elo[-1]["Aaron"] == 1000
+    assert data.ema[-1][1]["Zoe"]['rank'] == -1
+
+    data.add_alias("Zo", "Zoe")
+    data.add_game(Game(["Zo", "Aaron", "Joueur 00", "Joueur 01"], [30, 10, -15, -25], games[100].date + dt.timedelta(minutes=1)))
+    assert_same_results(data, Data.from_dict(data.to_dict()))
+
+def test_remove_player_added_in_same_ingest():
+    players, aliases, games = make_tournament()
+    data = Data(games, players, aliases)
+    with data.ingest():
+        data.add_player(Player("Aaron", 1000))
+        data.add_game(Game(["Aaron", "Joueur 00", "Joueur 01", "Joueur 02"], [30, 10, -15, -25], games[0].date - dt.timedelta(days=1)))
+        data.add_player(Player("Zoe", 1000))
+        assert data.remove_player("Aaron") == (0, "")
+        data.add_player(Player("Bob", 1000))
+        assert data.remove_player("Zoe") == (0, "")
+    assert not("Aaron" in data.elo.columns) and "Bob" in data.elo.columns
+    assert_same_results(data, Data.from_dict(data.to_dict()))
+
+def test_remove_player_replays_from_first_game():
+    players, aliases, games = make_tournament()
+    data = Data(games, players, aliases)
+    with data.ingest():
+        assert data.remove_player("Joueur 03") == (0, "")
+        data.add_player(Player("Aaron", 1000))
+    assert_same_results(data, Data.from_dict(data.to_dict()))
+
+def test_binary_arrays_have_explicit_dtypes():
+    payload = b"<i8" + (2).to_bytes(8, "little") + (-5).to_bytes(8, "little", signed=True) + (2**40).to_bytes(8, "little")
+    payload += b"|u1" + (1).to_bytes(8, "little") + b"\x07"
+    assert _unpack_arrays(payload) == [[-5, 2**40], [7]]
+    arrays = [np.array([-5, 2**40], dtype=np.int64), np.array([1.5]), np.array([7], dtype=np.uint8)]
+    assert _pack_arrays(arrays).startswith(payload[:27])
+    assert _unpack_arrays(_pack_arrays(arrays)) == [[-5, 2**40], [1.5], [7]]
+
+    players, aliases, games = make_tournament()
+    data = Data(games, players, aliases)
+    assert_same_results(Data.from_bytes(data.to_bytes()), data)
@@ -0,0 +1,32 @@
+from loaders import *
+import openpyxl # type: ignore
+
+def write_workbook(file_path: str, player_rows: list[list]):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Donnees"
+    sheet.append(['Vent', 'Est', 'Sud', 'Ouest', 'Nord', "Partie 1"])
+    sheet.append(['Nom joueur', 'Anna', 'Bob', 'Carl', 'Dora', dt.datetime(2025, 3, 1, 20)])
+    sheet.append(['Mini-points', 30, 10, -15, -25])
+    sheet.append(['Points de table', 3, 2, 1, 0])
+    sheet = workbook.create_sheet("EMA points")
+    sheet.append([None])
+    sheet.append(['Noms', 'Elo base'])
+    for row in player_rows:
+        sheet.append(row)
+    workbook.save(file_path)
+
+def test_excel_player_rows_are_checked(tmp_path):
+    file_path = str(tmp_path / "games.xlsx")
+    write_workbook(file_path, [
+        ['Anna', 1000], ['Bob', 1100.5], [None, None], ['Carl', 900],
+        ['Note : elos de septembre', None], [None, 1000], ['Dora', 'abc'], ['Eve', 950]
+    ])
+    players, games, errors = parse_games_excel(file_path)
+    assert [(p.name, p.base_elo) for p in players] == [('Anna', 1000), ('Bob', 1100.5), ('Carl', 900), ('Eve', 950)]
+    assert errors == [
+        "Joueur ligne 7 : elo invalide",
+        "Joueur ligne 8 : nom manquant",
+        "Joueur ligne 9 : elo invalide"
+    ]
+    assert len(games) == 1
@@ -0,0 +1,24 @@
+from data import *
+from projection import *
+from test_data import make_tournament
+
+def test_month_state_counts_the_games_of_the_month_so_far():
+    players, aliases, games = make_tournament()
+    data = Data(games, players, aliases)
+    date = dt.datetime(2025, 2, 10, 23)
+    state = get_month_state(data, date)
+    february = [game for game in games if dt.datetime(2025, 2, 1) <= game.date <= date]
+    assert state['num_month'] == 2025 * 12 + 2
+    assert state['month_games'].sum() == 4 * len(february)
+    assert state['remaining_games'] == len(february) / 10 * 18
+
+def test_projection_of_a_month_without_games_yet():
+    players, aliases, games = make_tournament()
+    data = Data(games, players, aliases)
+    date = dt.datetime(2025, 5, 1, 12)
+    state = get_month_state(data, date)
+    assert state['month_games'].sum() == 0
+    assert state['remaining_games'] > 0
+    assert project_month_ema(data, 1000, remaining_games=0, date=date) == {}
+    projection = project_month_ema(data, 1000, date=date)
+    assert len(projection) == len(players)
@@ -0,0 +1,96 @@
+from data import *
+from storage import *
+from test_data import make_tournament, assert_same_results
+
+def test_journal_replays_add_then_remove_player(tmp_path):
+    players, aliases, games = make_tournament()
+    file_path = str(tmp_path / "games.bin")
+    save_data(Data(games, players, aliases), file_path)
+
+    data = load_data(file_path)
+    data.add_player(Player("Aaron", 1000))
+    data.add_game(Game(["Aaron", "Joueur 00", "Joueur 01", "Joueur 02"], [30, 10, -15, -25], games[-1].date + dt.timedelta(days=1)))
+    data.remove_player("Aaron")
+    data.add_player(Player("Zoe", 1100))
+    save_data(data, file_path)
+    data.journal.close()
+
+    loaded = load_data(file_path)
+    loaded.journal.close()
+    assert [p.name for p in loaded.players] == [p.name for p in data.players]
+    assert_same_results(loaded, data)
+
+def test_journal_replays_removed_games_and_aliases(tmp_path):
+    players, aliases, games = make_tournament()
+    file_path = str(tmp_path / "games.bin")
+    save_data(Data(games, players, aliases), file_path)
+
+    data = load_data(file_path)
+    data.add_alias("J5", "Joueur 05")
+    data.remove_games([0, 1, 2, 50])
+    data.remove_aliases(["J5"])
+    save_data(data, file_path)
+    data.journal.close()
+
+    loaded = load_data(file_path)
+    loaded.journal.close()
+    assert len(loaded.games) == len(games) - 4
+    assert not("J5" in loaded.aliases)
+    assert_same_results(loaded, data)
+
+def test_compact_save_keeps_direct_changes(tmp_path):
+    players, aliases, games = make_tournament()
+    file_path = str(tmp_path / "games.bin")
+    save_data(Data(games, players, aliases), file_path)
+
+    data = load_data(file_path)
+    data.players[0].base_elo = 1234 # Comme depuis le terminal de commandes
+    save_data(data, file_path, compact=True)
+    data.journal.close()
+
+    loaded = load_data(file_path)
+    loaded.journal.close()
+    assert loaded.players[0].base_elo == 1234
+
+def test_second_load_keeps_journal_of_open_session(tmp_path):
+    players, aliases, games = make_tournament()
+    file_path = str(tmp_path / "games.bin")
+    save_data(Data(games[:-1], players, aliases), file_path)
+
+    first = load_data(file_path)
+    second = load_data(file_path)
+    read_only = load_data(file_path, read_only=True)
+    assert first.add_game(games[-1]) == (0, "")
+    save_data(first, file_path)
+    first.journal.close()
+    second.journal.close()
+
+    loaded = load_data(file_path)
+    loaded.journal.close()
+    assert len(loaded.games) == len(games)
+    assert read_only.journal is None and len(read_only.games) == len(games) - 1
+
+def test_torn_journal_line_is_truncated(tmp_path):
+    players, aliases, games = make_tournament()
+    file_path = str(tmp_path / "games.bin")
+    save_data(Data(games[:-2], players, aliases), file_path)
+
+    data = load_data(file_path)
+    data.add_game(games[-2])
+    data.journal.close()
+    with open(file_path + ".journal", "a") as f:
+        f.write('{"op": "add_game", "ga') # Arret brutal pendant l'ecriture
+
+    data = load_data(file_path)
+    data.add_game(games[-1])
+    data.journal.close()
+    loaded = load_data(file_path, read_only=True)
+    assert len(loaded.games) == len(games)
+
+def test_read_only_load_does_not_migrate(tmp_path):
+    players, aliases, games = make_tournament()
+    save_data(Data(games, players, aliases), str(tmp_path / "games.json"))
+
+    data = load_data(str(tmp_path / "games.bin"), read_only=True)
+    assert len(data.games) == len(games)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["games.json"]
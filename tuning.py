@@ -0,0 +1,121 @@
+from data import *
+from storage import *
+from profiling import profiled
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+SWEEP_OUTPUT_FILE = "./sweep_output.txt"
+SWEEP_PARAMS = ['ELO_K', 'ELO_K_NEWBIE_ADD', 'ELO_K_NEWBIE_SCALE', 'ELO_DIFF_SCALING'] # Colonnes des configurations
+SWEEP_METRICS = ['log_loss', 'rank_accuracy', 'points_rmse']
+SWEEP_MIN_PARALLEL = 32 # En dessous, les configurations sont rejouees dans ce processus
+SWEEP_EPSILON = 1e-12 # Borne des probabilites du log-loss
+
+def make_grid(k: list[float], newbie_add: list[float], newbie_scale: list[float], diff_scaling: list[float]) -> np.ndarray:
+    """ Every combination of the values, one configuration per row with the columns of SWEEP_PARAMS """
+    return np.array(list(itertools.product(k, newbie_add, newbie_scale, diff_scaling)), dtype=np.float64).reshape(-1, len(SWEEP_PARAMS))
+
+def get_replay_arrays(data: Data) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The game history as arrays, in the order of data.games
+    return (base elo of each player id, player id of each seat, rank points of each seat,
+    nb games of each seat before the game)
+    """
+    base_elos = np.array([p.base_elo for p in data.player_by_id], dtype=np.float64)
+    ids = np.array([game.player_ids for game in data.games], dtype=np.int64).reshape(-1, 4)
+    points = np.array([rank_points(game.end_points) for game in data.games], dtype=np.float64).reshape(-1, 4)
+
+    # Le nombre de parties ne depend pas des parametres : rang de chaque siege parmi les parties de son joueur
+    seats = ids.ravel()
+    order = np.argsort(seats, kind='stable')
+    first_seat = np.searchsorted(seats[order], seats[order], side='left')
+    nb_games = np.empty(len(seats), dtype=np.int64)
+    nb_games[order] = np.arange(len(seats)) - first_seat
+    return (base_elos, ids, points, nb_games.reshape(-1, 4))
+
+def replay_configs(params: np.ndarray, base_elos: np.ndarray, ids: np.ndarray, points: np.ndarray, nb_games: np.ndarray, warmup: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Replays every game once for all the configurations at the same time (the configurations are the first axis)
+    Each game is scored before its elos are updated, the first 'warmup' games are only replayed
+    return (metrics of each configuration with the columns of SWEEP_METRICS, final elos of each configuration)
+    """
+    k, newbie_add, newbie_scale, diff_scaling = (params[:, i:i+1] for i in range(len(SWEEP_PARAMS)))
+    scaling = diff_scaling[:, :, None]
+    elos = np.tile(base_elos, (len(params), 1))
+    pairs = np.triu_indices(4, 1)
+
+    # Resultat de chaque paire de sieges : 1 si le premier finit devant, 0.5 en cas d'egalite
+    outcomes = (np.sign(points[:, pairs[0]] - points[:, pairs[1]]) + 1) / 2
+    decided = outcomes != 0.5
+
+    log_loss = np.zeros(len(params))
+    nb_correct = np.zeros(len(params))
+    squared_error = np.zeros(len(params))
+    for igame in range(len(ids)):
+        seat_ids = ids[igame]
+        seat_elos = elos[:, seat_ids]
+        # win[c, i, j] : probabilite que le siege i finisse devant le siege j, comme dans 'expected_points'
+        win = 1.0 / (1.0 + 10 ** ((seat_elos[:, None, :] - seat_elos[:, :, None]) / scaling))
+        expected = win.sum(axis=2) - 0.5 # Sans la paire du siege avec lui-meme
+        coef = k + newbie_add / (newbie_scale + nb_games[igame])
+        elos[:, seat_ids] = seat_elos + coef * (points[igame] - expected)
+
+        if igame >= warmup:
+            win_pairs = np.clip(win[:, pairs[0], pairs[1]], SWEEP_EPSILON, 1 - SWEEP_EPSILON)
+            outcome = outcomes[igame]
+            log_loss -= (outcome * np.log(win_pairs) + (1 - outcome) * np.log(1 - win_pairs)).sum(axis=1)
+            nb_correct += ((win_pairs > 0.5) == (outcome == 1))[:, decided[igame]].sum(axis=1)
+            squared_error += ((expected - points[igame]) ** 2).sum(axis=1)
+
+    nb_scored = max(len(ids) - warmup, 0)
+    metrics = np.stack([
+        log_loss / max(nb_scored * len(pairs[0]), 1),
+        nb_correct / max(decided[warmup:].sum(), 1),
+        np.sqrt(squared_error / max(nb_scored * 4, 1))
+    ], axis=1)
+    return (metrics, elos)
+
+@profiled
+def sweep(data: Data, params: np.ndarray, warmup: int = 0, max_workers: int|None = None) -> list[dict]:
+    """
+    Scores each configuration (row of 'params', columns of SWEEP_PARAMS) on the whole game history
+    The configurations are split between processes, return one dict per configuration by increasing log-loss
+    """
+    arrays = get_replay_arrays(data)
+    nb_chunks = min(max_workers or os.cpu_count() or 1, len(params))
+    if nb_chunks <= 1 or len(params) < SWEEP_MIN_PARALLEL:
+        metrics = replay_configs(params, *arrays, warmup)[0]
+    else:
+        with ProcessPoolExecutor(nb_chunks) as pool:
+            futures = [pool.submit(replay_configs, chunk, *arrays, warmup) for chunk in np.array_split(params, nb_chunks)]
+            metrics = np.concatenate([future.result()[0] for future in futures])
+
+    results = []
+    for config, config_metrics in zip(params.tolist(), metrics.tolist()):
+        results.append({**dict(zip(SWEEP_PARAMS, config)), **dict(zip(SWEEP_METRICS, config_metrics))})
+    results.sort(key=lambda x: x['log_loss'])
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Balayage des parametres du calcul des elos")
+    parser.add_argument("--data", default="./games.bin")
+    parser.add_argument("--k", nargs="+", type=float, default=[10.0, 15.0, 20.0, 25.0, 30.0])
+    parser.add_argument("--newbie-add", nargs="+", type=float, default=[0.0, 25.0, 50.0, 100.0])
+    parser.add_argument("--newbie-scale", nargs="+", type=float, default=[1.0, 2.0, 5.0])
+    parser.add_argument("--diff-scaling", nargs="+", type=float, default=[200.0, 300.0, 400.0, 600.0])
+    parser.add_argument("--warmup", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--output", default=SWEEP_OUTPUT_FILE)
+    args = parser.parse_args()
+
+    data = load_data(args.data, read_only=True) # Le menu peut avoir la sauvegarde ouverte
+    params = make_grid(args.k, args.newbie_add, args.newbie_scale, args.diff_scaling)
+    results = sweep(data, params, args.warmup, args.workers)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=4)
+    print(f"{len(results)} configurations, {len(data.games)} parties")
+    print("".join(f"{name:>20}" for name in SWEEP_PARAMS + SWEEP_METRICS))
+    for result in results[:args.top]:
+        print("".join(f"{result[name]:20.4f}" for name in SWEEP_PARAMS + SWEEP_METRICS))
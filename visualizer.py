@@ -1,26 +1,37 @@
+from __future__ import annotations
 import matplotlib.pyplot as plt
 from data import *
+from profiling import profiled
+import hashlib
 import os
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from typing import Callable
+
+PLOT_CACHE_FILE = ".plot_cache.json" # Empreintes des images deja enregistrees dans un dossier
+PLOT_MIN_PARALLEL = 4 # En dessous, les images sont dessinees sans processus supplementaires
 
 class Visualizer:
     def __init__(self, data: Data):
         self.data = data
+        self.stats_cache = {}
     
-    def plot_elos(self, players_per_plot: int = 4, save_file: str = ""):
+    @profiled
+    def plot_elos(self, players_per_plot: int = 4, save_file: str = "", max_workers: int|None = None):
+        if len(self.data.games) == 0:
+            return
         # Extract shared time axis
-        dates = [g.date for g in self.data.games]
+        dates = np.array([g.date for g in self.data.games], dtype='datetime64[us]')
+        names = list(self.data.elo.columns)
 
-        # All player names
-        all_players = list(sorted(
-            self.data.elo[0].keys(),
-            key = lambda x : self.data.elo[-1][x], # Sort by elo
-            reverse = True
-        ))
+        # All player names, sorted by elo
+        all_players = np.argsort(-self.data.elo.row(-1)[list(self.data.elo.columns.values())], kind='stable')
 
-        # Manual chunking
-        def chunked(iterable, size):
-            for i in range(0, len(iterable), size):
-                yield iterable[i:i+size]
+        # Remove duplicates of dates : only the last game of each day, from the
+        # last game before the first change of elo of the player
+        last_of_day = np.append(dates[1:] - dates[:-1] >= np.timedelta64(1, 'D'), True)
 
         # Prepare save mode
         save_mode = None
@@ -31,53 +42,36 @@ class Visualizer:
             else:
                 save_mode = "prefix"
 
-        # Create a figure for each group of players
-        fig_index = 1
-        for group in chunked(all_players, players_per_plot):
-            plt.figure(figsize=(10, 6))
-
-            for player in group:
-                elo_values = [elo[player] for elo in self.data.elo]
-
-                # Remove duplicates of dates
-                dates_no_dup = []
-                elo_values_no_dup = []
-                still_starting_elo = True
-                for i in range(len(dates)):
-                    if still_starting_elo and (i == len(dates) - 1 or elo_values[i+1] != elo_values[i]):
-                        still_starting_elo = False
-                        dates_no_dup.append(dates[i])
-                        elo_values_no_dup.append(elo_values[i])
-                    if not(still_starting_elo) and (i == len(dates) - 1 or (dates[i+1] - dates[i]).days >= 1):
-                        dates_no_dup.append(dates[i])
-                        elo_values_no_dup.append(elo_values[i])
-                        
-                plt.plot(dates_no_dup, elo_values_no_dup, label=player)
-                # plt.plot(dates, elo_values, label=player)
-
-            plt.xlabel("Date")
-            plt.ylabel("Elo Rating")
-            plt.title(f"Elo Progression — {', '.join(group)}")
-            plt.legend()
-            plt.grid(True)
-            plt.tight_layout()
-
-            # Save if needed
+        # One plot for each group of players
+        plots = []
+        for i in range(0, len(all_players), players_per_plot):
+            group = all_players[i:i+players_per_plot]
+            group_names = [names[id] for id in group]
+            series = []
+            for id in group:
+                elos = self.data.elo.column(names[id])
+                changes = np.flatnonzero(elos[1:] != elos[:-1])
+                start = changes[0] if len(changes) > 0 else len(dates) - 1
+                kept = np.concatenate([[start], start + np.flatnonzero(last_of_day[start:])])
+                series.append((names[id], dates[kept], elos[kept]))
+
+            out_path = ""
             if save_mode == "directory":
-                out_path = os.path.join(save_file, f"elo_{"_".join(group)}.png")
-                plt.savefig(out_path)
+                out_path = os.path.join(save_file, f"elo_{"_".join(group_names)}.png")
             elif save_mode == "prefix":
-                out_path = f"{save_file}_{"_".join(group)}.png"
-                plt.savefig(out_path)
-            
-            # Show only when not saving
-            if save_file == "":
-                plt.show()
+                out_path = f"{save_file}_{"_".join(group_names)}.png"
+            plots.append({
+                'kind': 'elo',
+                'path': out_path,
+                'figsize': (10, 6),
+                'savefig': {},
+                'title': f"Elo Progression — {', '.join(group_names)}",
+                'series': series
+            })
+        render_plots(plots, max_workers)
 
-            plt.close()
-            fig_index += 1
-
-    def plot_emas(self, save_file: str = ""):
+    @profiled
+    def plot_emas(self, save_file: str = "", max_workers: int|None = None):
         # Prepare save mode
         save_mode = None
         if save_file != "":
@@ -89,6 +83,7 @@ class Visualizer:
 
         # Prepare the table
         months_name = ['Jan', 'Fev', 'Mars', 'Avr', 'Mai', 'Juin', 'Juil', 'Aout', 'Sept', 'Oct', 'Nov', 'Dec']
+        plots = []
         for id_month, ema_stats in self.data.ema:
             month = (id_month - 1) % 12
             year = (id_month - 1) // 12
@@ -110,31 +105,21 @@ class Visualizer:
             )
             ema_table.insert(0, [date_name, 'Elo', 'Rang', 'Nb parties', 'EMA mois', 'EMA total'])
 
-            fig, ax = plt.subplots()
-            ax.axis('off')
-            fig.tight_layout()
-
-            table = ax.table(
-                cellText=ema_table,
-                cellLoc='center',
-                loc='center'
-            )
-
-            table.scale(1.0, 1.2)
-            for i in range(len(ema_table[0])):
-                table[(0, i)].set_text_props(weight="bold")
-
-            # Save if needed
+            out_path = ""
             if save_mode == "directory":
                 out_path = os.path.join(save_file, f"ema_{months_name[month]}_{year}.png")
-                plt.savefig(out_path, dpi=200, bbox_inches="tight")
             elif save_mode == "prefix":
                 out_path = f"{save_file}_{date_name}.png"
-                plt.savefig(out_path, dpi=200, bbox_inches="tight")
-
-            if save_file == "":
-                plt.show()
+            plots.append({
+                'kind': 'ema',
+                'path': out_path,
+                'figsize': tuple(plt.rcParams['figure.figsize']),
+                'savefig': {'dpi': 200, 'bbox_inches': "tight"},
+                'table': ema_table
+            })
+        render_plots(plots, max_workers)
 
+    @profiled
     def print_players(self, max_aliases: int = 4):
         alias_list = {}
         for player in self.data.players:
@@ -152,6 +137,7 @@ class Visualizer:
                 print(", ...", end="")
             print(")")
 
+    @profiled
     def calc_winning_wind_full_game(self) -> dict[str, list[list[tuple]]]:
         """
         Calculates the frequency of winning a game for each player and each wind
@@ -159,76 +145,301 @@ class Visualizer:
         one special player name for the total : 'total'
         one special 5th wind for the total
         """
+        counts = self._get_cached_stat('wind', self._init_wind_counts, self._add_games_wind, self._add_player_wind)
         freqs = {}
-        default_freqs = [[0 for place in range(4)] for wind in range(5)]
-        players_with_total = self.data.players + ['total']
-        for p in players_with_total:
-            freqs[p] = deepcopy(default_freqs)
-        for game in self.data.games:
-            rank_points = pd.Series(game.end_points).rank()
-            for wind in range(4):
-                player_name = self.data.aliases[game.players[wind]]
-                freqs[player_name][wind][4 - int(rank_points[wind])] += 1
-                freqs[player_name][4][4 - int(rank_points[wind])] += 1
-                freqs['total'][wind][4 - int(rank_points[wind])] += 1
-                freqs['total'][4][4 - int(rank_points[wind])] += 1
-        for p in players_with_total:
+        for p, count in counts.items():
+            freqs[p] = []
             for wind in range(5):
                 S = 0.00000001
                 for place in range(4):
-                    S += freqs[p][wind][place]
-                for place in range(4):
-                    freqs[p][wind][place] = (freqs[p][wind][place], freqs[p][wind][place] / S)
+                    S += count[wind][place]
+                freqs[p].append([(count[wind][place], count[wind][place] / S) for place in range(4)])
         return freqs
+
+    def _init_wind_counts(self) -> dict[str, list[list[int]]]:
+        counts = {}
+        players_with_total = self.data.players + ['total']
+        for p in players_with_total:
+            counts[p] = [[0 for place in range(4)] for wind in range(5)]
+        return counts
+
+    def _add_games_wind(self, counts: dict[str, list[list[int]]], games: list[Game]):
+        for game in games:
+            game_points = rank_points(game.end_points)
+            for wind in range(4):
+                player_name = self.data.player_by_id[game.player_ids[wind]].name
+                place = 3 - int(game_points[wind])
+                counts[player_name][wind][place] += 1
+                counts[player_name][4][place] += 1
+                counts['total'][wind][place] += 1
+                counts['total'][4][place] += 1
+
+    def _add_player_wind(self, counts: dict[str, list[list[int]]], player: Player) -> dict[str, list[list[int]]]:
+        counts[player.name] = [[0 for place in range(4)] for wind in range(5)]
+        return counts
     
+    @profiled
     def calc_nb_encounters(self) -> dict[str, dict[str, int]]:
         """
         Calculates the number of time each player has played against each other in the tournament
         return count tab : {player 1: {player 2: count}}
         """
-        counts = {}
-        players_with_total = [p.name for p in self.data.players] + ['total']
-        for p1 in players_with_total:
-            counts[p1] = {}
-            for p2 in players_with_total:
-                counts[p1][p2] = 0
-        for game in self.data.games:
-            counts['total']['total'] += 1
-            for a1 in game.players:
-                p1 = self.data.aliases[a1]
-                counts[p1]['total'] += 1
-                counts['total'][p1] += 1
-                for a2 in game.players:
-                    p2 = self.data.aliases[a2]
-                    if p1 != p2:
-                        counts[p1][p2] += 1
-        return counts
+        counts = self.get_encounter_matrix()
+        names = [p.name for p in self.data.players]
+        ids = self._get_ids(names)
+        ids['total'] = len(counts) - 1
+        return MatrixView(names + ['total'], ids, lambda i, j: int(counts[i, j]))
+
+    def get_encounter_matrix(self) -> np.ndarray:
+        """ Count tab [player id][player id] with the totals in an extra last row and column """
+        return self._get_cached_stat('encounters', self._init_encounters, self._add_games_encounters, self._add_player_encounters).copy()
+
+    def _init_encounters(self) -> np.ndarray:
+        """ Matrice [player id][player id] avec une ligne et une colonne en plus pour le total """
+        nb_players = len(self.data.player_by_id)
+        return np.zeros((nb_players + 1, nb_players + 1), dtype=np.int64)
+
+    def _add_player_encounters(self, counts: np.ndarray, player: Player) -> np.ndarray:
+        """ The new id comes just before the total """
+        total = len(counts) - 1
+        return np.insert(np.insert(counts, total, 0, axis=0), total, 0, axis=1)
+
+    def _add_games_encounters(self, counts: np.ndarray, games: list[Game]):
+        total = len(counts) - 1
+        ids = self._get_game_ids(games)
+        counts[total, total] += len(games)
+        counts[:, total] += np.bincount(ids.ravel(), minlength=total + 1)
+        counts[total, :] += np.bincount(ids.ravel(), minlength=total + 1)
+        rows, cols = self._get_pairs(ids)
+        same = rows == cols
+        counts += np.bincount(
+            (rows * (total + 1) + cols)[~same],
+            minlength=(total + 1)**2
+        ).reshape(counts.shape)
     
+    @profiled
     def calc_nemesis(self) -> dict[str, dict[str, dict[str, float]]]:
-        stats = {}
-        players = [p.name for p in self.data.players]
+        """
+        Calculates the number of wins of each player against each other (a draw counts for half)
+        return stats tab : {player 1: {player 2: {'nb_wins', 'nb_total', 'win_rate', 'smoothed_rate'}}}
+        """
         alpha = 2
-        for p1 in players:
-            stats[p1] = {}
-            for p2 in players:
-                if p1 != p2:
-                    stats[p1][p2] = {'nb_wins': 0.0, 'nb_total': 0.0, 'win_rate': 0.0, 'smoothed_rate': 0.0}
-        for game in self.data.games:
-            for i in range(len(game.players)):
-                a1 = self.data.aliases[game.players[i]]
-                for j in range(i+1, len(game.players)):
-                    a2 = self.data.aliases[game.players[j]]
-                    stats[a1][a2]['nb_total'] += 1
-                    stats[a2][a1]['nb_total'] += 1
-                    if game.end_points[i] < game.end_points[j]:
-                        a1, a2 = a2, a1
-                    if game.end_points[i] == game.end_points[j]:
-                        stats[a1][a2]['nb_wins'] += 0.5
-                        stats[a2][a1]['nb_wins'] += 0.5
-                    else:
-                        stats[a1][a2]['nb_wins'] += 1
-                    stats[a1][a2]['win_rate'] = stats[a1][a2]['nb_wins'] / stats[a1][a2]['nb_total']
-                    stats[a2][a1]['win_rate'] = stats[a2][a1]['nb_wins'] / stats[a2][a1]['nb_total']
-                    stats[a1][a2]['smoothed_rate'] = (stats[a1][a2]['nb_wins'] + alpha) / (stats[a1][a2]['nb_total'] + 2 * alpha)
-                    stats[a2][a1]['smoothed_rate'] = (stats[a2][a1]['nb_wins'] + alpha) / (stats[a2][a1]['nb_total'] + 2 * alpha)
-        return stats
\ No newline at end of file
+        nb_wins, nb_total = self._get_cached_stat('nemesis', self._init_nemesis, self._add_games_nemesis, self._add_player_nemesis)
+        names = [p.name for p in self.data.players]
+        played = nb_total > 0
+        win_rate = np.zeros(nb_wins.shape)
+        smoothed_rate = np.zeros(nb_wins.shape)
+        win_rate[played] = nb_wins[played] / nb_total[played]
+        smoothed_rate[played] = (nb_wins[played] + alpha) / (nb_total[played] + 2 * alpha)
+        nb_wins = nb_wins.copy()
+        nb_total = nb_total.copy()
+        def get_stat(i: int, j: int) -> dict[str, float]:
+            return {
+                'nb_wins': float(nb_wins[i, j]),
+                'nb_total': float(nb_total[i, j]),
+                'win_rate': float(win_rate[i, j]),
+                'smoothed_rate': float(smoothed_rate[i, j])
+            }
+        return MatrixView(names, self._get_ids(names), get_stat, with_diagonal=False)
+
+    def _init_nemesis(self) -> tuple[np.ndarray, np.ndarray]:
+        """ Matrices [player id][player id] des victoires et des rencontres """
+        nb_players = len(self.data.player_by_id)
+        return (np.zeros((nb_players, nb_players)), np.zeros((nb_players, nb_players)))
+
+    def _add_player_nemesis(self, stat: tuple[np.ndarray, np.ndarray], player: Player) -> tuple[np.ndarray, np.ndarray]:
+        return tuple(np.pad(matrix, ((0, 1), (0, 1))) for matrix in stat)
+
+    def _add_games_nemesis(self, stat: tuple[np.ndarray, np.ndarray], games: list[Game]):
+        nb_wins, nb_total = stat
+        nb_players = len(nb_total)
+        ids = self._get_game_ids(games)
+        end_points = np.array([game.end_points for game in games], dtype=np.int64).reshape(-1, 4)
+        rows, cols = self._get_pairs(ids)
+        points_rows, points_cols = self._get_pairs(end_points)
+        wins = (points_rows > points_cols) + 0.5 * (points_rows == points_cols)
+        different = rows != cols
+        pairs = (rows * nb_players + cols)[different]
+        nb_total += np.bincount(pairs, minlength=nb_players**2).reshape(nb_total.shape)
+        nb_wins += np.bincount(pairs, weights=wins[different], minlength=nb_players**2).reshape(nb_wins.shape)
+
+    def _get_ids(self, names: list[str]) -> dict[str, int]:
+        return {name: self.data.name_to_player_id[name] for name in names}
+
+    def _get_game_ids(self, games: list[Game]) -> np.ndarray:
+        """ Tab [num game][wind] of the player ids """
+        return np.array([game.player_ids for game in games], dtype=np.int64).reshape(-1, 4)
+
+    def _get_pairs(self, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """ Values of the first and of the second wind of every ordered pair of different winds, game by game """
+        winds_1, winds_2 = np.nonzero(~np.eye(4, dtype=bool))
+        return (values[:, winds_1].ravel(), values[:, winds_2].ravel())
+
+    def _get_cached_stat(self, name: str, init_stat: Callable, add_games: Callable, add_player: Callable):
+        """
+        Returns the statistic 'name' kept since the last call, with the games added
+        since then folded in (the order of the games does not matter)
+        add_player(stat, player) returns the stat with room for the id of a new player
+        Any other change of the players or of the games recomputes it from scratch
+        """
+        version, stat = self.stats_cache.get(name, (None, None))
+        changes = self.data.changes_since(version)
+        new_games = []
+        for kind, obj in changes or []:
+            if kind == 'add_game':
+                new_games.append(obj)
+            elif kind == 'add_player': # Les parties deja comptees n'ont pas ce joueur
+                stat = add_player(stat, obj)
+            elif not(kind in ['recompute', 'add_rounds', 'add_alias']):
+                changes = None
+                break
+        if changes is None:
+            stat = init_stat()
+            new_games = self.data.games
+        if len(new_games) > 0:
+            add_games(stat, new_games)
+        self.stats_cache[name] = (self.data.version, stat)
+        return stat
+
+
+class MatrixView(Mapping):
+    """
+    Read-only view {name 1: {name 2: value}} over matrices indexed by player ids
+    get_value(id 1, id 2) gives the value of a pair
+    """
+    def __init__(self, names: list[str], ids: dict[str, int], get_value: Callable, with_diagonal: bool = True):
+        self.names = names
+        self.ids = ids
+        self.get_value = get_value
+        self.with_diagonal = with_diagonal
+
+    def __getitem__(self, name: str) -> MatrixRowView:
+        return MatrixRowView(self, name)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+
+class MatrixRowView(Mapping):
+    def __init__(self, matrix: MatrixView, name: str):
+        self.matrix = matrix
+        self.name = name
+        self.id = matrix.ids[name]
+
+    def __getitem__(self, name: str):
+        if not(self.matrix.with_diagonal) and name == self.name:
+            raise KeyError(name)
+        return self.matrix.get_value(self.id, self.matrix.ids[name])
+
+    def __iter__(self) -> Iterator[str]:
+        for name in self.matrix.names:
+            if self.matrix.with_diagonal or name != self.name:
+                yield name
+
+    def __len__(self) -> int:
+        return len(self.matrix.names) - (0 if self.matrix.with_diagonal else 1)
+
+
+def draw_elo_plot(fig: Figure, plot: dict):
+    ax = fig.subplots()
+    for name, dates, elos in plot['series']:
+        ax.plot(dates, elos, label=name)
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Elo Rating")
+    ax.set_title(plot['title'])
+    ax.legend()
+    ax.grid(True)
+    fig.tight_layout()
+
+def draw_ema_table(fig: Figure, plot: dict):
+    ax = fig.subplots()
+    ax.axis('off')
+    fig.tight_layout()
+
+    table = ax.table(
+        cellText=plot['table'],
+        cellLoc='center',
+        loc='center'
+    )
+
+    table.scale(1.0, 1.2)
+    for i in range(len(plot['table'][0])):
+        table[(0, i)].set_text_props(weight="bold")
+
+PLOT_DRAWERS = {'elo': draw_elo_plot, 'ema': draw_ema_table}
+
+def render_plots(plots: list[dict], max_workers: int|None = None):
+    """
+    Shows the plots one by one when they have no path, else saves them
+    Images whose content did not change since they were saved are skipped (PLOT_CACHE_FILE
+    of their folder), the others are drawn in parallel processes
+    """
+    if len(plots) == 0:
+        return
+    if plots[0]['path'] == "":
+        for plot in plots:
+            fig = plt.figure(figsize=plot['figsize'])
+            PLOT_DRAWERS[plot['kind']](fig, plot)
+            plt.show()
+            plt.close(fig)
+        return
+
+    cache_path = os.path.join(os.path.dirname(plots[0]['path']), PLOT_CACHE_FILE)
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+    to_render = []
+    for plot in plots:
+        plot_hash = get_plot_hash(plot)
+        if cache.get(plot['path']) != plot_hash or not(os.path.exists(plot['path'])):
+            to_render.append(plot)
+            cache[plot['path']] = plot_hash
+
+    # Un lot par processus, qui reutilise sa figure d'un graphe a l'autre
+    nb_batches = min(max_workers or os.cpu_count() or 1, len(to_render))
+    if nb_batches <= 1 or len(to_render) < PLOT_MIN_PARALLEL:
+        save_plots(to_render)
+    else:
+        with ProcessPoolExecutor(nb_batches) as pool:
+            for future in [pool.submit(save_plots, to_render[i::nb_batches]) for i in range(nb_batches)]:
+                future.result()
+
+    with open(cache_path, "w") as f:
+        json.dump(cache, f, indent=4)
+
+def save_plots(plots: list[dict]):
+    """ Draws and saves the plots with one Agg figure of each size, cleared between two plots """
+    figures = {}
+    for plot in plots:
+        if not(plot['figsize'] in figures):
+            figures[plot['figsize']] = Figure(figsize=plot['figsize'])
+            FigureCanvasAgg(figures[plot['figsize']])
+        fig = figures[plot['figsize']]
+        fig.clear()
+        PLOT_DRAWERS[plot['kind']](fig, plot)
+        fig.savefig(plot['path'], **plot['savefig'])
+
+def get_plot_hash(plot: dict) -> str:
+    """ Hash of everything drawn on the plot """
+    h = hashlib.sha1()
+    def update(value):
+        if isinstance(value, np.ndarray):
+            h.update(str(value.dtype).encode())
+            h.update(value.tobytes())
+        elif isinstance(value, (list, tuple)):
+            h.update(b"[")
+            for v in value:
+                update(v)
+            h.update(b"]")
+        elif isinstance(value, dict):
+            for k in sorted(value):
+                update(k)
+                update(value[k])
+        else:
+            h.update(repr(value).encode() + b";")
+    update(plot)
+    return h.hexdigest()